@@ -0,0 +1,306 @@
+""" Offline benchmarks for the game. Nothing here calls a remote service.
+
+Run from the game/ directory, e.g.:
+
+    python bench.py ingest
+    python bench.py ingest --lines 5000 --latency 0.05 --failure-rate 0.02
+    python bench.py query
+    python bench.py tick --npcs 50 --latency 0.2
+    python bench.py cache --npcs 50 --latency 0.05
+    python bench.py world --places 2000 --npcs 5000
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from character import Character, make_messages, make_prompt
+from embeddings import FakeEmbeddings, HashingEmbeddings
+from llm import ResponseCache, ScriptedChat
+from lore import Lore
+from scene.village import init_village
+from scheduler import Scheduler
+from world import Item, Place, World
+
+
+def _write_lore(lore_dir: Path, lines: int, files: int) -> None:
+    rng = random.Random(1337)
+    subjects = ["The inn", "A ranger", "The kitchen", "An inn-keeper", "The village", "A mug of ale", "The keg"]
+    verbs = ["is near", "belongs to", "is cheaper than", "is older than", "is guarded by", "smells like"]
+    lore_dir.mkdir(parents=True, exist_ok=True)
+    for f in range(files):
+        with open(lore_dir / f"lore{f}.txt", "w") as out:
+            for i in range(f, lines, files):
+                out.write(f"{rng.choice(subjects)} {rng.choice(verbs)} {rng.choice(subjects).lower()} #{i}.\n")
+
+
+def bench_ingest(args):
+    """ Lore startup with a fake embedding backend: one line per request vs batched, concurrent requests, then a warm restart. """
+    runs = {
+        "per-line": {"batch_size": 1, "concurrency": 1},
+        "batched": {"batch_size": args.batch_size, "concurrency": args.concurrency},
+    }
+    print(f"{args.lines} lines, {args.latency * 1e3:.0f} ms per request, {args.failure_rate:.0%} of requests fail")
+    with tempfile.TemporaryDirectory() as tmp:
+        lore_dir = Path(tmp) / "lore"
+        _write_lore(lore_dir, args.lines, args.files)
+        for name, options in runs.items():
+            persist_dir = Path(tmp) / name
+            embed = FakeEmbeddings(args.dim, args.latency, args.failure_rate)
+            t0 = time.perf_counter()
+            Lore(str(lore_dir), str(persist_dir), embed, retries=args.retries, backoff=args.backoff, **options)
+            cold = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            Lore(str(lore_dir), str(persist_dir), embed, retries=args.retries, backoff=args.backoff, **options)
+            warm = time.perf_counter() - t0
+            print(f"{name:>9}: cold start {cold:7.2f} s ({args.lines / cold:8.0f} lines/s, {embed.requests} requests), "
+                  f"warm restart {warm * 1e3:7.1f} ms")
+
+
+def bench_query(args):
+    """ Lore.query latency with the in-process HashingEmbeddings backend: embedding alone, embedding plus search, and a repeated (cached) query. """
+    backend = HashingEmbeddings(args.dim)
+    rng = random.Random(1337)
+    with tempfile.TemporaryDirectory() as tmp:
+        lore_dir = Path(tmp) / "lore"
+        _write_lore(lore_dir, args.lines, 1)
+        lore = Lore(str(lore_dir), str(Path(tmp) / "persist"), backend)
+        queries = [f"strider the ranger, in the {rng.choice(['inn', 'kitchen', 'village'])}, carrying coin #{i}"
+                   for i in range(args.queries)]
+        t0 = time.perf_counter()
+        for q in queries:
+            backend([q])
+        embed = (time.perf_counter() - t0) / len(queries)
+        t0 = time.perf_counter()
+        for q in queries:
+            lore.query(q, args.k)
+        query = (time.perf_counter() - t0) / len(queries)
+        t0 = time.perf_counter()
+        for q in queries:
+            lore.query(q, args.k)
+        repeated = (time.perf_counter() - t0) / len(queries)
+    print(f"{args.lines} lines, {backend.model}: embed {embed * 1e6:.0f} us/query, embed + top-{args.k} search {query * 1e3:.3f} ms/query, "
+          f"repeated {repeated * 1e6:.1f} us/query")
+
+
+def bench_tick(args):
+    """ Village ticks against the scripted chat stub and local lore: characters thinking one after another vs the scheduler. """
+    with tempfile.TemporaryDirectory() as tmp:
+        lore = Lore("./lore", tmp, HashingEmbeddings())
+        world = World(lore, ScriptedChat(latency=args.latency))
+        village = init_village(world)
+        for i in range(args.npcs):
+            Character(f"villager{i}", "villager", village["inn"])
+        n = len(world.characters)
+        print(f"{n} characters, {args.latency * 1e3:.0f} ms per chat call")
+
+        t0 = time.perf_counter()
+        for _ in range(args.ticks):
+            for char in world.characters:
+                char.think()
+        sequential = (time.perf_counter() - t0) / args.ticks
+
+        scheduler = Scheduler(world, args.concurrency)
+        scheduler.tick() # the first tick starts the event loop and its worker threads
+        t0 = time.perf_counter()
+        for _ in range(args.ticks):
+            scheduler.tick()
+        scheduled = (time.perf_counter() - t0) / args.ticks
+        scheduler.close()
+    for name, t in (("sequential", sequential), ("scheduler", scheduled)):
+        print(f"{name:>10}: {t * 1e3:8.2f} ms/tick, {1 / t:8.1f} ticks/s, {n / t:9.0f} decisions/s")
+
+
+def _prompt_keys(seed: int) -> list[str]:
+    """ The ResponseCache keys of every village character's first request, with everyone thirsty, hungry and
+        tired (a set of strings). Objects are allocated at addresses that depend on the seed. """
+    padding = [object() for _ in range(seed * 997)]
+    with tempfile.TemporaryDirectory() as tmp:
+        world = World(Lore("./lore", tmp, HashingEmbeddings()), ScriptedChat())
+        village = init_village(world)
+        for i in range(8):
+            padding.append(object())
+            Character(f"villager{i}", "villager", village["inn"]).states.update(["thirsty", "hungry", "tired"])
+        cache = ResponseCache()
+        keys = []
+        for char in world.characters:
+            perception = char.perceive()
+            prompt = make_prompt(knowledge=world.lore.query(perception['query'], 6), **perception['args'])
+            keys.append(cache.key(world.llm.model, char.temperature, make_messages(prompt)))
+        return keys
+
+
+def bench_cache(args):
+    """ Village ticks, with decisions applied, without and with a ResponseCache in front of the scripted chat stub. """
+    for name, cache in (("uncached", None), ("cached", ResponseCache())):
+        with tempfile.TemporaryDirectory() as tmp:
+            lore = Lore("./lore", tmp, HashingEmbeddings())
+            world = World(lore, ScriptedChat(latency=args.latency, cache=cache))
+            village = init_village(world)
+            for i in range(args.npcs):
+                Character(f"villager{i}", "villager", village["inn"])
+            # The stub always waits, and a character that keeps waiting keeps getting the same prompt
+            # (see character.recent), so only the first couple of ticks need the model.
+            t0 = time.perf_counter()
+            for _ in range(args.ticks):
+                for char in world.characters:
+                    char.think()
+            t = (time.perf_counter() - t0) / args.ticks
+            if cache is None:
+                print(f"{len(world.characters)} characters, {args.ticks} ticks, {args.latency * 1e3:.0f} ms per chat call")
+            stats = f", hit rate {cache.hit_rate:.1%}" if cache else ""
+            print(f"{name:>9}: {t * 1e3:8.2f} ms/tick, {world.llm.calls:6d} chat calls{stats}")
+
+    # A cache on disk only helps if a restarted game builds the same prompts; sets iterate in a different order
+    # in each process (string hashes are randomized, and objects hash by address), so check that none leak through.
+    keys = set()
+    for seed in range(3):
+        out = subprocess.run([sys.executable, "-c", f"import bench; print(*bench._prompt_keys({seed}))"], capture_output=True,
+                             text=True, check=True, env={**os.environ, "PYTHONHASHSEED": str(seed)})
+        keys.add(out.stdout.strip())
+    assert len(keys) == 1, "the same village state gave different prompts in different processes"
+    print("prompts are identical across processes")
+
+
+def _build_world(args, world: World) -> tuple[list[Character], dict[Place, list[str]], dict[Place, list[tuple[str, str]]]]:
+    """ A random world of args.places places, each with args.children child places, args.items items (of args.kinds
+        kinds) spread over it and its children, and exits to a few others; with args.npcs characters in it.
+        Also returns each place's exits, and the (child place or None, item) names of what was put in it, by name. """
+    rng = random.Random(1337)
+    places = [Place(world, f"place{i}") for i in range(args.places)]
+    contents = {}
+    for i, place in enumerate(places):
+        rooms = [place] + [Place(world, f"room{c}", place) for c in range(args.children)]
+        contents[place] = []
+        for j in range(args.items):
+            item = Item(f"thing{rng.randrange(args.kinds)}")
+            item.consumable = True
+            room = rng.choice(rooms)
+            room.add_item(item)
+            contents[place].append((room.name if room is not place else None, item.name))
+        Place.connect(place, places[(i + 1) % len(places)])
+        for _ in range(args.exits - 2):
+            Place.connect(place, rng.choice(places))
+    exits = {place: sorted(exit.name for exit in place.exits) for place in places}
+    chars = [Character(f"npc{i}", "villager", rng.choice(places)) for i in range(args.npcs)]
+    return chars, exits, contents
+
+
+def _actions(args, chars: list[Character]) -> list[tuple[Character, str, float, float]]:
+    """ Random actions: who acts, the verb, and two numbers in [0, 1) that pick what the action names once it is
+        known what is there (see _name_action). """
+    rng = random.Random(42)
+    verbs = ["move", "take", "take", "put", "give", "consume"]
+    return [(rng.choice(chars), rng.choice(verbs), rng.random(), rng.random()) for _ in range(args.actions)]
+
+
+def _name_action(char: Character, verb: str, u: float, v: float, exits: dict, contents: dict) -> list[str]:
+    """ An action naming things that (mostly) exist, as a model that reads its prompt would: one of the character's
+        exits, an item that was put in its place (which someone may have taken since), something it carries,
+        and someone there. All by sorted names, so the scan and indexed runs play out the same. """
+    pick = lambda options, x: options[int(x * len(options))]
+    match verb:
+        case "move":
+            return ["move", pick(exits[char.place], u), None]
+        case "take":
+            child, name = pick(contents[char.place], u)
+            return ["take", name, child]
+    carried = sorted(item.name for item in char.inventory) or ["nothing"]
+    if verb == "give":
+        return ["give", pick(carried, u), pick(sorted(c.name for c in char.place.characters), v)]
+    return [verb, pick(carried, u), None]
+
+
+def _check_malformed(chars: list[Character]) -> None:
+    """ Replies are parsed with ast.literal_eval, so arguments can be any literal, including unhashable ones;
+        acting on them must fail like any other name that isn't there, not raise. """
+    char = chars[0]
+    for action in (["take", "thing1", ["room0"]], ["take", ["thing1"], None], ["move", ["place1"], None],
+                   ["put", ["thing1"], None], ["give", "thing1", ["npc1"]], ["consume", {"thing1": 1}, None]):
+        before = len(char.events)
+        char.act(*action)
+        assert len(char.events) == before + 1 and char.events[-1].startswith("you tried"), (action, char.events[-1])
+
+
+def bench_world(args):
+    """ Action resolution in a large generated world, with the places' and characters' name indexes vs scanning for names. """
+    results = {}
+    for name, indexed in (("scan", False), ("indexed", True)):
+        world = World(None, ScriptedChat())
+        world.indexed = indexed
+        chars, exits, contents = _build_world(args, world)
+        actions = _actions(args, chars)
+        # Every action is broadcast to stdout, and heard by everyone nearby; that isn't what's being measured.
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            for char, verb, u, v in actions:
+                char.states.add("thirsty")  # consume() assumes it
+                char.act(*_name_action(char, verb, u, v, exits, contents))
+            t = time.perf_counter() - t0
+            failed = sum(event.startswith("you tried") for char in chars for event in char.events)
+            _check_malformed(chars)
+        results[name] = (t, failed)
+    print(f"{args.places} places with {args.children} children, {args.places * args.items} items, {args.npcs} characters, "
+          f"{args.actions} actions")
+    for name, (t, failed) in results.items():
+        print(f"{name:>8}: {t:7.3f} s, {args.actions / t:9.0f} actions/s, {args.actions - failed} succeeded, {failed} failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(required=True)
+
+    p = sub.add_parser("ingest", help=bench_ingest.__doc__)
+    p.add_argument("--lines", type=int, default=1000, help="synthetic lore lines")
+    p.add_argument("--files", type=int, default=4, help="lore files the lines are spread over")
+    p.add_argument("--dim", type=int, default=1536, help="embedding size")
+    p.add_argument("--latency", type=float, default=0.01, help="seconds per fake embedding request")
+    p.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests that fail and are retried")
+    p.add_argument("--batch-size", type=int, default=64)
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--retries", type=int, default=5)
+    p.add_argument("--backoff", type=float, default=0.01, help="seconds before the first retry")
+    p.set_defaults(fn=bench_ingest)
+
+    p = sub.add_parser("query", help=bench_query.__doc__)
+    p.add_argument("--lines", type=int, default=1000, help="synthetic lore lines")
+    p.add_argument("--dim", type=int, default=1024, help="hashed embedding size")
+    p.add_argument("--queries", type=int, default=1000)
+    p.add_argument("--k", type=int, default=6, help="results per query, as in Character.think")
+    p.set_defaults(fn=bench_query)
+
+    p = sub.add_parser("tick", help=bench_tick.__doc__)
+    p.add_argument("--npcs", type=int, default=0, help="villagers added to the inn, besides the village's own characters")
+    p.add_argument("--ticks", type=int, default=200)
+    p.add_argument("--latency", type=float, default=0.0, help="seconds per scripted chat call")
+    p.add_argument("--concurrency", type=int, default=None, help="scheduler's limit on characters deciding at once (default none)")
+    p.set_defaults(fn=bench_tick)
+
+    p = sub.add_parser("cache", help=bench_cache.__doc__)
+    p.add_argument("--npcs", type=int, default=0, help="villagers added to the inn, besides the village's own characters")
+    p.add_argument("--ticks", type=int, default=20)
+    p.add_argument("--latency", type=float, default=0.01, help="seconds per scripted chat call")
+    p.set_defaults(fn=bench_cache)
+
+    p = sub.add_parser("world", help=bench_world.__doc__)
+    p.add_argument("--places", type=int, default=1000)
+    p.add_argument("--children", type=int, default=4, help="child places per place")
+    p.add_argument("--items", type=int, default=1000, help="items per place, including its children")
+    p.add_argument("--kinds", type=int, default=500, help="distinct item names")
+    p.add_argument("--exits", type=int, default=4, help="about how many exits each place has")
+    p.add_argument("--npcs", type=int, default=2000)
+    p.add_argument("--actions", type=int, default=50000)
+    p.set_defaults(fn=bench_world)
+
+    args = parser.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()
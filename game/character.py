@@ -1,8 +1,10 @@
 from __future__ import annotations
 import ast
-import openai
+import asyncio
+from concurrent.futures import Executor
 from typing import Iterable
-from world import Place, Item
+from llm import LLMBackend
+from world import Item, NameIndex, Place, scan
 from typing import TypedDict, Unpack
 
 
@@ -11,7 +13,7 @@ class PromptArgs(TypedDict):
     job: str
     place: str
     time: str
-    states: set[str]
+    states: list[str]
     knowledge: list[str]
     exits: list[Place]
     characters: list[Character]
@@ -58,6 +60,20 @@ On the next line, list any new goals, or ["none"].
 """
 
 
+class Perception(TypedDict):
+    query: str        # lore query for the character's situation
+    args: PromptArgs  # everything make_prompt needs but knowledge
+
+
+class Decision(TypedDict):
+    action: list[str]
+    completed: list[int]
+    new_goals: list[str]
+    query: str
+    prompt: str
+    response: str
+
+
 def _make_system(**kwargs: Unpack[PromptArgs]):
     return """
         You are playing a character in a text adventure.
@@ -77,54 +93,75 @@ def make_system(**kwargs: Unpack[PromptArgs]):
     """
 
 
+def make_messages(prompt: str) -> list[dict]:
+    return [
+        {"role": "system", "content": make_system()},
+        {"role": "user", "content": prompt},
+    ]
+
+
 class Character:
     place: Place
     name: str
     job: str
     states: set[str]
-    inventory: set[Item]
+    inventory: set[Item]  # change only with add_item and remove_item, which keep inventory_index up to date
+    inventory_index: NameIndex
     goals: list[str]
     events: list[str]
+    llm: LLMBackend  # None to use the world's
+    temperature: float = 0.5
+    use_cache: bool = True  # False to always ask the model, even if the backend has a ResponseCache
+    recent_events: int = None  # the most events the prompt shows, or None for all of them; see recent()
 
     # Debug stuff.
     last_knowledge_query: str
     last_prompt: str
-    last_response: any
+    last_response: str
 
-    def __init__(self, name: str, job: str, place: Place) -> None:
+    def __init__(self, name: str, job: str, place: Place, llm: LLMBackend = None) -> None:
         self.place = place
+        self.llm = llm
         self.name = name
         self.job = job
         self.states = set()
         self.inventory = set()
+        self.inventory_index = NameIndex()
         self.goals = []
         self.events = []
-        place.characters.add(self)
+        place.add_character(self)
+        place.world.characters.append(self)
 
     def __repr__(self) -> str:
         return f"{self.name} the {self.job}"
 
     def find_item(self, name: str) -> Item:
-        for item in self.inventory:
-            if item.name == name:
-                return item
-        return None
+        if self.place.world.indexed:
+            return self.inventory_index.get(name)
+        return scan(self.inventory, name)
 
     def remove_item(self, item: Item) -> None:
         self.inventory.remove(item)
+        self.inventory_index.remove(item)
 
     def add_item(self, item: Item) -> None:
         self.inventory.add(item)
+        self.inventory_index.add(item)
 
     def event(self, event: str) -> None:
         self.events.append(event.replace(self.name, "you"))
 
-    def think(self, debug=False):
-        exits = self.place.available_exits()
-        characters = self.place.visible_characters()
-        items = self.place.visible_items()
-
-        # Get contextual knowledge from lore, using contextual information.
+    def perceive(self) -> Perception:
+        """ Snapshot everything this character can see and knows, to decide its next action from.
+            The snapshot is a copy, so it is unaffected by anything that happens after it was taken.
+            Everything that comes from a set is sorted by name, so that the same situation always gives the
+            same prompt (and lore query), whatever the sets' iteration order, e.g. in another process. """
+        exits = sorted(self.place.available_exits(), key=get_name)
+        characters = sorted(self.place.visible_characters(), key=get_name)
+        items = sorted(self.place.visible_items(), key=get_name)
+        inventory = sorted(self.inventory, key=get_name)
+
+        # Query for contextual knowledge from lore, using contextual information.
         query = f"""
             {self.name}
             {self.job}
@@ -133,52 +170,66 @@ class Character:
             {list_it(exits)}
             {list_it(characters)}
             {list_it(items)}
-            {list_it(self.inventory)}
+            {list_it(inventory)}
             {list_it(self.goals)}
         """
-        knowledge = self.place.world.lore.query(query, 6)
-        self.last_knowledge_query = query
-
-        # Prompt the model to consider the character's knowledge, situation, and state,
-        # and decide on the next action to take.
-        prompt = make_prompt(
-            name=self.name,
-            job=self.job,
-            place=self.place.name,
-            time=self.place.world.time,
-            states=self.states,
-            knowledge=knowledge,
-            exits=exits,
-            characters=characters,
-            items=items,
-            inventory=self.inventory,
-            goals=self.goals,
-            events=self.events,
-        )
-
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            temperature=0.5,
-            messages=[
-                {"role": "system", "content": make_system()},
-                {"role": "user", "content": prompt},
-            ]
-        )
-        [action, completed, new_goals] = self.parse_response(
-            response.choices[0].message.content)
-        self.last_prompt = prompt
-        self.last_response = response
+        return {
+            'query': query,
+            'args': {
+                'name': self.name,
+                'job': self.job,
+                'place': self.place.name,
+                'time': self.place.world.time,
+                'states': sorted(self.states),
+                'exits': exits,
+                'characters': characters,
+                'items': items,
+                'inventory': inventory,
+                'goals': list(self.goals),
+                'events': recent(self.events, self.recent_events),
+            },
+        }
+
+    def decide(self, perception: Perception) -> Decision:
+        """ Ask the model for the next action, given a perception snapshot. """
+        knowledge = self.place.world.lore.query(perception['query'], 6)
+        prompt = make_prompt(knowledge=knowledge, **perception['args'])
+        response = (self.llm or self.place.world.llm).chat(make_messages(prompt), self.temperature, self.use_cache)
+        return self._decision(perception, prompt, response)
+
+    async def decide_async(self, perception: Perception, executor: Executor = None) -> Decision:
+        """ decide(), without blocking the event loop: the lore query runs on a worker thread (of `executor`,
+            or the loop's default one), and the model call is made asynchronously. """
+        loop = asyncio.get_running_loop()
+        knowledge = await loop.run_in_executor(executor, self.place.world.lore.query, perception['query'], 6)
+        prompt = make_prompt(knowledge=knowledge, **perception['args'])
+        response = await (self.llm or self.place.world.llm).achat(make_messages(prompt), self.temperature, self.use_cache)
+        return self._decision(perception, prompt, response)
+
+    def _decision(self, perception: Perception, prompt: str, response: str) -> Decision:
+        [action, completed, new_goals] = self.parse_response(response)
+        # Always three values, even when the response held no action at all.
+        action = (action + [None, None, None])[:3]
+        return {'action': action, 'completed': completed, 'new_goals': new_goals,
+                'query': perception['query'], 'prompt': prompt, 'response': response}
+
+    def apply(self, decision: Decision, debug=False, blocked: str = None) -> None:
+        """ Update goals and perform the decided action. If `blocked` is given (e.g., because another
+            character got to an item first), the action is not performed, and `blocked` is recorded instead. """
+        action, completed, new_goals = decision['action'], decision['completed'], decision['new_goals']
+        self.last_knowledge_query = decision['query']
+        self.last_prompt = decision['prompt']
+        self.last_response = decision['response']
 
         # Parse the results.
         if debug:
-            print(f"> action: {action}")
-            print(f"> completed: {completed}")
-            print(f"> new-goals: {new_goals}")
-
-        # Mark done.
-        completed.sort(reverse=True)
-        for idx in completed:
-            if idx is not None:
+            print(f"> {self.name} action: {action}")
+            print(f"> {self.name} completed: {completed}")
+            print(f"> {self.name} new-goals: {new_goals}")
+
+        # Mark done. Indices refer to the goals as perceived, which only this character changes.
+        for idx in sorted(set(completed), reverse=True):
+            if idx is not None and 0 <= idx < len(self.goals):
                 del self.goals[idx]
 
         # Update goals.
@@ -187,9 +238,16 @@ class Character:
                 self.goals.append(goal)
 
         # Perform the action.
-        self.act(*action)
+        if blocked is not None:
+            self.events.append(blocked)
+        else:
+            self.act(*action)
         # self.event(f"didn't understand '{response}'")
 
+    def think(self, debug=False):
+        """ Perceive, decide and act, for this character alone. See scheduler.py to tick every character at once. """
+        self.apply(self.decide(self.perceive()), debug)
+
     def parse_response(self, rsp: str) -> list[list[str]]:
         """ Parse the model's response. It can be a bit unpredictable, so this function is very defensive.
             The result is guaranteed to be of the form:
@@ -279,6 +337,20 @@ class Character:
             self.events.append(event)
 
 
+def recent(events: list[str], n: int = None) -> list[str]:
+    """ The events, with runs of the same event collapsed into one, and only the last n of them if n is given.
+        A character whose situation hasn't changed (e.g., one that waits, tick after tick) then gets the same
+        prompt each time, so its reply can come from the ResponseCache. """
+    out = []
+    for event in reversed(events):
+        if out and out[-1] == event:
+            continue
+        if len(out) == n:
+            break
+        out.append(event)
+    return out[::-1]
+
+
 # Kind of hacky -- generates a newline-separated list of items from any Iterable.
 # Currently handles list[str | Item | Place | Character | Document]
 def list_it(items: Iterable[any]) -> str:
@@ -0,0 +1,119 @@
+import hashlib
+import random
+import re
+import time
+import zlib
+from collections import Counter
+import numpy as np
+
+
+# Embedding backends turn batches of texts into vectors for Lore. Any object with a `model` name,
+# a `transient_errors` tuple and a __call__(texts) -> vectors method will do; EmbeddingBackend
+# documents that interface, and the classes below implement it.
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingBackend:
+    """ Turns a batch of texts into a batch of vectors.
+        `model` names the embedding space: vectors are only comparable (and cached) within one model,
+        so it must change whenever the backend's settings would change its vectors.
+        `transient_errors` are the exceptions worth retrying a request for.
+        `local` backends run in-process, and Lore then searches its documents in-process too, rather than
+        through the vector store, so that a whole query stays well under a millisecond. """
+    model: str
+    transient_errors: tuple = ()
+    local: bool = False
+
+    def __call__(self, texts: list[str]) -> list[list[float]]:
+        raise NotImplementedError
+
+
+class OpenAIEmbeddings(EmbeddingBackend):
+    """ Embeddings from the OpenAI API, one request per batch of texts. """
+
+    def __init__(self, model: str = "text-embedding-ada-002") -> None:
+        import openai
+        self.openai = openai
+        self.model = model
+        self.transient_errors = (openai.error.Timeout, openai.error.APIConnectionError, openai.error.RateLimitError,
+                                 openai.error.ServiceUnavailableError, openai.error.APIError)
+
+    def __call__(self, texts: list[str]) -> list[list[float]]:
+        # Newlines can negatively affect performance (see openai.embeddings_utils).
+        response = self.openai.Embedding.create(input=[text.replace("\n", " ") for text in texts], model=self.model)
+        return [d["embedding"] for d in sorted(response["data"], key=lambda d: d["index"])]
+
+
+class HashingEmbeddings(EmbeddingBackend):
+    """ A local embedding that runs in-process on the CPU, with no model to load: the text's words, word pairs
+        and the character n-grams of each word are hashed into `dim` buckets (the "hashing trick"),
+        weighted by sublinear term frequency, given a random sign per feature so that collisions tend to
+        cancel out, and L2-normalized.
+        It keeps no corpus statistics (so no IDF weighting; a short stop-word list stands in for it), which
+        means a text's vector never changes, and vectors can be cached by content hash like any other model's.
+        Retrieval quality is that of a bag of words with fuzzy matching on word stems, not of a semantic
+        model, but it takes microseconds per text. """
+    local = True
+    stop_words = frozenset("a an and are as at be by for from has have i in is it of on or that the this to was "
+                           "were will with you your".split())
+
+    def __init__(self, dim: int = 1024, ngrams: tuple[int, int] = (3, 5)) -> None:
+        self.dim = dim
+        self.ngrams = ngrams
+        self.model = f"hashing-{dim}-{ngrams[0]}-{ngrams[1]}"
+
+    def _features(self, text: str) -> list[str]:
+        words = [w for w in re.findall(r"[a-z0-9]+(?:'[a-z]+)?", text.lower()) if w not in self.stop_words]
+        features = [f"w:{w}" for w in words]
+        features += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+        lo, hi = self.ngrams
+        for w in words:
+            padded = f"<{w}>"
+            for n in range(lo, min(hi, len(padded)) + 1):
+                features += [padded[i:i + n] for i in range(len(padded) - n + 1)]
+        return features
+
+    def embed(self, text: str) -> np.ndarray:
+        counts = Counter(self._features(text))
+        vec = np.zeros(self.dim, dtype=np.float32)
+        if not counts:
+            return vec
+        # crc32 rather than hash(), which is salted per process.
+        h = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in counts), dtype=np.uint32, count=len(counts))
+        weights = 1.0 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+        signs = np.where(h & 0x80000000, -1.0, 1.0).astype(np.float32)
+        np.add.at(vec, h % self.dim, signs * weights)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def __call__(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed(text).tolist() for text in texts]
+
+
+class FakeEmbeddings(EmbeddingBackend):
+    """ Deterministic pseudo-random unit vectors, one per distinct text, for running and benchmarking offline.
+        Each request takes `latency` seconds, and fails with a TimeoutError with probability `failure_rate`,
+        to stand in for a remote backend. The vectors carry no meaning, so retrieval results are arbitrary. """
+    transient_errors = (TimeoutError,)
+
+    def __init__(self, dim: int = 1536, latency: float = 0.0, failure_rate: float = 0.0, model: str = "fake") -> None:
+        self.dim = dim
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.model = f"{model}-{dim}"
+        self.requests = 0
+
+    def __call__(self, texts: list[str]) -> list[list[float]]:
+        self.requests += 1
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise TimeoutError("fake embedding request timed out")
+        vecs = []
+        for text in texts:
+            rng = np.random.default_rng(int(content_hash(text)[:16], 16))
+            vec = rng.standard_normal(self.dim)
+            vecs.append((vec / np.linalg.norm(vec)).tolist())
+        return vecs
@@ -0,0 +1,340 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+
+# Chat model backends for Character. Every backend takes OpenAI-style messages
+# ([{"role": "system" | "user" | "assistant", "content": ...}]) and returns the reply's text,
+# with chat() for synchronous callers and achat() for the asyncio scheduler. LLMBackend adds
+# rate limiting, timeouts, retries and an optional ResponseCache on top of each backend's _chat/_achat.
+
+
+class RateLimiter:
+    """ A token bucket: on average at most `rate` requests per second, in bursts of up to `burst`.
+        Thread-safe, and shared by a backend's synchronous and asynchronous calls. """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.interval = 1.0 / rate
+        self.burst = burst
+        self.next = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """ Claim the next request slot; returns how many seconds to wait before sending. """
+        with self.lock:
+            now = time.monotonic()
+            # Unused capacity accumulates, but only up to `burst` requests' worth.
+            self.next = max(self.next, now - (self.burst - 1) * self.interval)
+            delay = self.next - now
+            self.next += self.interval
+            return max(delay, 0.0)
+
+
+class ResponseCache:
+    """ Replies to chat requests, keyed by a hash of the model, the temperature and the messages, with
+        whitespace runs in the messages collapsed, so that formatting alone doesn't cause a miss.
+        The most recently used `max_entries` replies are kept in memory. With `path`, every reply is also
+        stored in an SQLite file, which outlives the process and isn't limited in size. Entries older than
+        `ttl` seconds (if given) are misses, and are deleted (from the file too, all at once when it is opened). Set `enabled` to False to bypass the cache entirely, e.g.
+        when the variety of sampling at a non-zero temperature is wanted.
+        Note that caching replies makes repeated requests deterministic, whatever the temperature. """
+    hits: int
+    misses: int
+
+    def __init__(self, max_entries: int = 10000, ttl: float = None, path: str = None) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = True
+        self.entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS replies (key TEXT PRIMARY KEY, created REAL NOT NULL, reply TEXT NOT NULL)")
+            if ttl is not None:
+                self.db.execute("DELETE FROM replies WHERE created < ?", (time.time() - ttl,))
+                self.db.commit()
+        self.hits = self.disk_hits = self.misses = 0
+
+    def key(self, model: str, temperature: float, messages: list[dict]) -> str:
+        normalized = [[m["role"], re.sub(r"\s+", " ", m["content"]).strip()] for m in messages]
+        return hashlib.sha256(json.dumps([model, temperature, normalized]).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str:
+        """ The cached reply, or None. """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            elif self.db is not None:
+                entry = self.db.execute("SELECT created, reply FROM replies WHERE key = ?", (key,)).fetchone()
+                if entry is not None and not self._expired(entry[0]):
+                    self.disk_hits += 1
+                    self._remember(key, entry)
+            if entry is None or self._expired(entry[0]):
+                if entry is not None:
+                    self.entries.pop(key, None)
+                    if self.db is not None:
+                        self.db.execute("DELETE FROM replies WHERE key = ?", (key,))
+                        self.db.commit()
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, reply: str) -> None:
+        with self.lock:
+            entry = (time.time(), reply)
+            self._remember(key, entry)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO replies VALUES (?, ?, ?)", (key, *entry))
+                self.db.commit()
+
+    def _remember(self, key: str, entry: tuple[float, str]) -> None:
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "hit_rate": self.hit_rate, "entries": len(self.entries)}
+
+
+class LLMBackend:
+    """ A chat model, called with OpenAI-style messages.
+        Requests are spaced by a RateLimiter when `rate_limit` (requests/second) is given, time out after
+        `timeout` seconds, and are retried up to `retries` times, after about backoff, 2 * backoff, ...
+        seconds, when they fail with one of the backend's transient_errors. Subclasses implement _chat,
+        and _achat if they have a native async client (otherwise _chat runs on a worker thread).
+        With a ResponseCache, a request that was made before is answered from the cache, without any
+        of that; pass use_cache=False to skip the cache for one request. """
+    model: str
+    transient_errors: tuple = ()
+
+    def __init__(self, model: str, timeout: float = 60.0, retries: int = 3, backoff: float = 1.0,
+                 rate_limit: float = None, burst: int = 1, cache: ResponseCache = None) -> None:
+        self.model = model
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = RateLimiter(rate_limit, burst) if rate_limit else None
+        self.cache = cache
+
+    def _cache_key(self, messages: list[dict], temperature: float, use_cache: bool) -> str:
+        if not use_cache or self.cache is None or not self.cache.enabled:
+            return None
+        return self.cache.key(self.model, temperature, messages)
+
+    def chat(self, messages: list[dict], temperature: float = 0.5, use_cache: bool = True) -> str:
+        key = self._cache_key(messages, temperature, use_cache)
+        reply = self.cache.get(key) if key is not None else None
+        if reply is None:
+            reply = self._request(messages, temperature)
+            if key is not None:
+                self.cache.put(key, reply)
+        return reply
+
+    async def achat(self, messages: list[dict], temperature: float = 0.5, use_cache: bool = True) -> str:
+        key = self._cache_key(messages, temperature, use_cache)
+        reply = self.cache.get(key) if key is not None else None
+        if reply is None:
+            reply = await self._arequest(messages, temperature)
+            if key is not None:
+                self.cache.put(key, reply)
+        return reply
+
+    def _request(self, messages: list[dict], temperature: float) -> str:
+        for attempt in range(self.retries + 1):
+            if self.limiter is not None:
+                time.sleep(self.limiter.reserve())
+            try:
+                return self._chat(messages, temperature)
+            except self.transient_errors:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self._backoff(attempt))
+
+    async def _arequest(self, messages: list[dict], temperature: float) -> str:
+        for attempt in range(self.retries + 1):
+            if self.limiter is not None:
+                await asyncio.sleep(self.limiter.reserve())
+            try:
+                return await asyncio.wait_for(self._achat(messages, temperature), self.timeout)
+            except (asyncio.TimeoutError, *self.transient_errors):
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+
+    def _backoff(self, attempt: int) -> float:
+        # Jittered, so that concurrent requests don't retry in lockstep.
+        return self.backoff * 2**attempt * random.uniform(0.5, 1.5)
+
+    def _chat(self, messages: list[dict], temperature: float) -> str:
+        raise NotImplementedError
+
+    async def _achat(self, messages: list[dict], temperature: float) -> str:
+        return await asyncio.to_thread(self._chat, messages, temperature)
+
+
+class OpenAIChat(LLMBackend):
+    """ OpenAI chat completions.
+        Synchronous calls reuse the openai package's per-thread requests session. Asynchronous calls share
+        one aiohttp session per event loop, rather than the package's default of a new session (and new
+        connections) per request; keep the loop alive between calls (as Scheduler does) to benefit. """
+
+    def __init__(self, model: str = "gpt-4", **kwargs) -> None:
+        super().__init__(model, **kwargs)
+        import openai
+        self.openai = openai
+        self.transient_errors = (openai.error.Timeout, openai.error.APIConnectionError, openai.error.RateLimitError,
+                                 openai.error.ServiceUnavailableError, openai.error.APIError)
+        self.sessions = {}
+
+    def _chat(self, messages: list[dict], temperature: float) -> str:
+        response = self.openai.ChatCompletion.create(model=self.model, temperature=temperature, messages=messages,
+                                                     request_timeout=self.timeout)
+        return response.choices[0].message.content
+
+    async def _achat(self, messages: list[dict], temperature: float) -> str:
+        token = self.openai.aiosession.set(self._session())
+        try:
+            response = await self.openai.ChatCompletion.acreate(model=self.model, temperature=temperature,
+                                                                messages=messages, request_timeout=self.timeout)
+        finally:
+            self.openai.aiosession.reset(token)
+        return response.choices[0].message.content
+
+    def _session(self):
+        import aiohttp
+        loop = asyncio.get_running_loop()
+        # Sessions are bound to the loop they were made on; forget those of loops that have since closed.
+        self.sessions = {l: s for l, s in self.sessions.items() if not l.is_closed()}
+        if loop not in self.sessions:
+            self.sessions[loop] = aiohttp.ClientSession()
+        return self.sessions[loop]
+
+    async def aclose(self) -> None:
+        """ Close the current loop's session. """
+        session = self.sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+
+class VertexChat(LLMBackend):
+    """ A Vertex AI chat model (see mpt/vertex.py). The model client is created once and reused; the system
+        message becomes the chat's context. The Vertex client has no per-request timeout, so `timeout`
+        only applies to achat(). """
+
+    def __init__(self, model: str = "chat-bison-001", project: str = None, location: str = "us-central1", **kwargs) -> None:
+        super().__init__(model, **kwargs)
+        from google.api_core import exceptions
+        from google.cloud import aiplatform
+        from google.cloud.aiplatform.private_preview.language_models import ChatModel
+        aiplatform.init(project=project, location=location)
+        self.chat_model = ChatModel.from_pretrained(model)
+        self.transient_errors = (exceptions.TooManyRequests, exceptions.ServiceUnavailable, exceptions.DeadlineExceeded,
+                                 exceptions.InternalServerError)
+
+    def _chat(self, messages: list[dict], temperature: float) -> str:
+        context = "\n".join(m["content"] for m in messages if m["role"] == "system")
+        chat = self.chat_model.start_chat(context=context, temperature=temperature)
+        reply = None
+        for m in messages:
+            if m["role"] == "user":
+                reply = chat.send_message(m["content"])
+        return reply.text if reply is not None else ""
+
+
+class HFChat(LLMBackend):
+    """ A local HuggingFace causal LM, e.g. MPT (see mpt/mpt.ipynb), prompted in the ChatML format that
+        mpt-7b-chat was tuned on. The model is loaded once; generation runs one request at a time, so
+        concurrent requests queue up rather than contend for the device. """
+
+    def __init__(self, model: str = "mosaicml/mpt-7b-chat", tokenizer: str = "EleutherAI/gpt-neox-20b",
+                 device: str = None, max_new_tokens: int = 128, **kwargs) -> None:
+        super().__init__(model, **kwargs)
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        self.torch = torch
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer)
+        self.lm = AutoModelForCausalLM.from_pretrained(model, trust_remote_code=True).to(self.device).eval()
+        self.max_new_tokens = max_new_tokens
+        self.lock = threading.Lock()
+
+    def _prompt(self, messages: list[dict]) -> str:
+        turns = [f"<|im_start|>{m['role']}\n{m['content'].strip()}<|im_end|>\n" for m in messages]
+        return "".join(turns) + "<|im_start|>assistant\n"
+
+    def _chat(self, messages: list[dict], temperature: float) -> str:
+        inputs = self.tokenizer(self._prompt(messages), return_tensors="pt").to(self.device)
+        with self.lock, self.torch.no_grad():
+            out = self.lm.generate(**inputs, max_new_tokens=self.max_new_tokens, do_sample=temperature > 0,
+                                   temperature=temperature if temperature > 0 else None,
+                                   pad_token_id=self.tokenizer.eos_token_id)
+        text = self.tokenizer.decode(out[0, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+        return text.split("<|im_end|>")[0].strip()
+
+
+def speaker(messages: list[dict]) -> str:
+    """ The name of the character a request is for (from the "Your name is ..." line of its prompt), or None. """
+    match = re.search(r"^Your name is (.+)\.$", messages[-1]["content"], re.MULTILINE)
+    return match.group(1) if match else None
+
+
+class ScriptedChat(LLMBackend):
+    """ A deterministic offline stand-in for a chat model, for simulations, tests and load tests.
+        `script` is a function from messages to the reply, a list of replies, or a dict of such lists by
+        character name. Each character steps through its list in turn (cycling), on its own, so which
+        character gets which reply doesn't depend on the order in which concurrent requests arrive.
+        By default (and for a character missing from a dict) every character waits. `latency` seconds are
+        added to each call, to model a remote backend; with no latency, a call costs microseconds. """
+    default_reply = '["wait"]\n["none"]\n["none"]'
+
+    def __init__(self, script: Callable[[list[dict]], str] | list[str] | dict[str, list[str]] = None,
+                 latency: float = 0.0, model: str = "scripted", **kwargs) -> None:
+        super().__init__(model, **kwargs)
+        self.script = script or [self.default_reply]
+        self.latency = latency
+        self.calls = 0
+        self.turns: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def _reply(self, messages: list[dict]) -> str:
+        if callable(self.script):
+            with self.lock:
+                self.calls += 1
+            return self.script(messages)
+        name = speaker(messages)
+        with self.lock:
+            self.calls += 1
+            n = self.turns.get(name, 0)
+            self.turns[name] = n + 1
+        replies = (self.script.get(name) or [self.default_reply]) if isinstance(self.script, dict) else self.script
+        return replies[n % len(replies)]
+
+    def _chat(self, messages: list[dict], temperature: float) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._reply(messages)
+
+    async def _achat(self, messages: list[dict], temperature: float) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._reply(messages)
@@ -1,8 +1,86 @@
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Iterator
 import chromadb
+import numpy as np
 from chromadb.api import API
 from chromadb.api.models.Collection import Collection
-from openai.embeddings_utils import get_embedding
+from chromadb.config import Settings
+from embeddings import EmbeddingBackend, OpenAIEmbeddings, content_hash
+
+
+def _with_retry(embed: EmbeddingBackend, texts: list[str], retries: int, backoff: float) -> list[list[float]]:
+    for attempt in range(retries + 1):
+        try:
+            return embed(texts)
+        except embed.transient_errors:
+            if attempt == retries:
+                raise
+            # Exponential backoff, with jitter so that concurrent requests don't retry in lockstep.
+            time.sleep(backoff * 2**attempt * random.uniform(0.5, 1.5))
+
+
+def embed_batches(texts: list[str], embed: EmbeddingBackend, batch_size: int = 64, concurrency: int = 4,
+                  retries: int = 5, backoff: float = 1.0) -> Iterator[tuple[list[str], list[list[float]]]]:
+    """ Embed texts in batches of batch_size, with up to `concurrency` requests in flight at once, yielding
+        each (batch, vectors) in order. A request that fails with one of the backend's transient errors
+        is retried up to `retries` times, after about backoff, 2 * backoff, 4 * backoff... seconds. """
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = pool.map(lambda batch: _with_retry(embed, batch, retries, backoff), batches)
+        yield from zip(batches, results)
+
+
+class EmbeddingCache:
+    """ Embeddings stored on disk (in SQLite), keyed by a hash of the model name and the embedded text,
+        so that a given text is only ever sent to a given model once.
+        It may be used from any thread (e.g. a Lore built on one thread and reloaded on another), one at a time. """
+    db: sqlite3.Connection
+
+    def __init__(self, path: str) -> None:
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB NOT NULL)")
+
+    def _key(self, model: str, text: str) -> str:
+        return content_hash(f"{model}\0{text}")
+
+    def get(self, model: str, text: str) -> list[float]:
+        """ The cached embedding of text, or None. """
+        with self.lock:
+            row = self.db.execute("SELECT vec FROM embeddings WHERE key = ?", (self._key(model, text),)).fetchone()
+        return np.frombuffer(row[0], dtype=np.float32).tolist() if row else None
+
+    def get_many(self, model: str, texts: list[str]) -> list[list[float]]:
+        """ The cached embedding of each text, or None, in a few queries rather than one per text. """
+        keys = [self._key(model, text) for text in texts]
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), 500): # SQLite limits the number of bound parameters
+                chunk = keys[i:i + 500]
+                rows = self.db.execute(f"SELECT key, vec FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                found.update(rows)
+        return [np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None for key in keys]
+
+    def put(self, model: str, text: str, vec: list[float]) -> None:
+        self.put_many(model, [text], [vec])
+
+    def put_many(self, model: str, texts: list[str], vecs: list[list[float]]) -> None:
+        # Stored as float32, which is all the precision similarity search needs, at half the size.
+        rows = [(self._key(model, text), np.asarray(vec, dtype=np.float32).tobytes()) for text, vec in zip(texts, vecs)]
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?)", rows)
+            self.db.commit()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
 
 
 # Encapsulates knowledge about the world, encoding it using embeddings, so that it can
@@ -12,37 +90,144 @@ class Lore:
     items: list[str]
     api: API
     embeddings: Collection
+    cache: EmbeddingCache
+    index: tuple[list[str], np.ndarray, np.ndarray]  # items, their vectors and squared norms; None unless the backend is local
+
+    # Lines are added to the collection this many at a time.
+    insert_batch = 1024
+    # Query embeddings and results are remembered for this many recent contexts.
+    query_cache_size = 4096
 
-    def __init__(self):
-        # For now, create a single collection for all lore, as a single in-memory ChromaDB collection.
-        # TODO: Make this persistent, so we don't have to keep spending time and money to re-encode lore.
+    def __init__(self, lore_dir: str = "./lore", persist_dir: str = "./.lore", backend: EmbeddingBackend = None,
+                 batch_size: int = 64, concurrency: int = 4, retries: int = 5, backoff: float = 1.0):
+        # All lore lives in a single ChromaDB collection, persisted under persist_dir, with each line's id
+        # being the hash of its text. Embeddings are also cached on disk by content hash, so on restart
+        # only new or changed lines are embedded, and the collection only has to be brought up to date.
+        # Lines and queries are embedded by `backend`: OpenAIEmbeddings by default, or e.g. HashingEmbeddings
+        # to run entirely in-process (see embeddings.py), in which case queries are answered from an in-memory
+        # matrix of the lines' vectors rather than by the collection. New lines are embedded in batches of batch_size, with up
+        # to `concurrency` requests at once; see embed_batches for retries and backoff.
+        self.backend = backend or OpenAIEmbeddings()
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.lore_dir = Path(lore_dir)
+        persist = Path(persist_dir)
+        persist.mkdir(parents=True, exist_ok=True)
         self.items = []
-        self.api = chromadb.Client()
-        self.embeddings = self.api.create_collection(name="lore")
+        self.api = chromadb.Client(Settings(chroma_db_impl="duckdb+parquet", persist_directory=str(persist / "chroma")))
+        # One collection per embedding model, since vectors from different models can't be compared.
+        self.embeddings = self.api.get_or_create_collection(name="lore-" + re.sub(r"[^A-Za-z0-9_-]", "-", self.backend.model)[:58])
+        self.cache = EmbeddingCache(str(persist / "embeddings.sqlite"))
+        # Queries may come from several threads at once (see scheduler.py); the collection is used by one at a time.
+        self.lock = threading.Lock()
+        # A character's query is the same from tick to tick until its situation changes, so query() remembers
+        # each recent context's embedding and top-k results, by content hash. Embeddings depend only on the
+        # context; results are dropped whenever the lore changes.
+        self.query_vecs: OrderedDict[str, list[float]] = OrderedDict()
+        self.query_results: OrderedDict[tuple[str, int], list[str]] = OrderedDict()
+        self.query_hits = self.query_misses = 0
         self._parse_all()
 
     # Parse everything in the lore directory, treating each line as a separate document.
     def _parse_all(self):
-        p = Path("./lore")
-        for i in p.rglob("**/*.txt"):
+        lines: dict[str, str] = {}
+        for i in sorted(self.lore_dir.rglob("**/*.txt")):
             if i.is_file():
-                lines = i.read_text().splitlines()
-                for line in lines:
+                for line in i.read_text().splitlines():
                     line = line.strip()
                     if len(line) > 0:
-                        self.items.append(line)
-                        id = f"{len(self.items)}"
-                        vec = get_embedding(line, "text-embedding-ada-002")
-                        self.embeddings.add(id, vec)
+                        lines.setdefault(content_hash(line), line)
+        self.items = list(lines.values())
+
+        # Sync the persisted collection with the lore on disk: drop lines that were removed or changed, add new ones.
+        # Lines are embedded without the lock, but the collection, the index and the cached query results are only
+        # changed under it, so a query running meanwhile (see scheduler.py) sees them either before or after a change.
+        with self.lock:
+            stored = set(self.embeddings.get(include=[])['ids'])
+        stale = [id for id in stored if id not in lines]
+        new = [id for id in lines if id not in stored]
+        with self.lock:
+            if stale:
+                self.embeddings.delete(ids=stale)
+                self.query_results.clear()
+        for i in range(0, len(new), self.insert_batch):
+            ids = new[i:i + self.insert_batch]
+            documents = [lines[id] for id in ids]
+            vecs = self._embed_all(documents)
+            with self.lock:
+                self.embeddings.add(ids=ids, embeddings=vecs, documents=documents)
+                self.query_results.clear()
+        index = None
+        if self.backend.local:
+            vectors = np.asarray(self._embed_all(self.items), dtype=np.float32).reshape(len(self.items), -1)
+            index = (list(self.items), vectors, np.einsum("ij,ij->i", vectors, vectors))
+        with self.lock:
+            if stale or new:
+                self.api.persist()
+            self.index = index
+            self.query_results.clear()
+
+    # Pick up lines added to (or removed from) the lore directory since it was last parsed.
+    def reload(self):
+        self._parse_all()
+
+    def _embed_all(self, texts: list[str]) -> list[list[float]]:
+        """ Embeddings of texts, from the cache where possible; the rest are embedded in batches and cached. """
+        model = self.backend.model
+        vecs = self.cache.get_many(model, texts)
+        missing = [text for text, vec in zip(texts, vecs) if vec is None]
+        fresh = {}
+        for batch, batch_vecs in embed_batches(missing, self.backend, self.batch_size, self.concurrency, self.retries, self.backoff):
+            # Cache each batch as it arrives, so an interrupted ingestion picks up where it stopped.
+            self.cache.put_many(model, batch, batch_vecs)
+            fresh.update(zip(batch, batch_vecs))
+        return [vec if vec is not None else fresh[text] for text, vec in zip(texts, vecs)]
 
     # Query for knoledge relevant to the given context.
     # This can be fed directly into the prompt.
     def query(self, context: str, max: int) -> list[str]:
-        vec = get_embedding(context, "text-embedding-ada-002")
-        result = self.embeddings.query(vec, None, max)
-        ids = result['ids'][0]
-        items: list[str] = []
-        for id in ids:
-            idx = int(id)-1
-            items.append(self.items[idx])
-        return items
+        key = content_hash(context)
+        with self.lock:
+            if (key, max) in self.query_results:
+                self.query_hits += 1
+                return list(_lru_get(self.query_results, (key, max)))
+            self.query_misses += 1
+            vec = _lru_get(self.query_vecs, key)
+        if vec is None:
+            vec = self.backend([context])[0]
+        with self.lock:
+            _lru_put(self.query_vecs, key, vec, self.query_cache_size)
+            if self.index is not None:
+                documents = self._search(vec, max)
+            else:
+                n = min(max, self.embeddings.count())
+                documents = self.embeddings.query(vec, None, n)['documents'][0] if n > 0 else []
+            _lru_put(self.query_results, (key, max), documents, self.query_cache_size)
+        return list(documents)
+
+    def _search(self, vec: list[float], max: int) -> list[str]:
+        """ The `max` items nearest to vec by L2 distance (as the collection ranks them), from the in-memory index. """
+        items, vectors, norms = self.index
+        n = min(max, len(items))
+        if n == 0:
+            return []
+        # |v - q|^2 = |v|^2 - 2 v.q + |q|^2, and the last term is the same for every item.
+        distances = norms - 2 * (vectors @ np.asarray(vec, dtype=np.float32))
+        top = np.argpartition(distances, n - 1)[:n]
+        return [items[i] for i in top[np.argsort(distances[top], kind="stable")]]
+
+
+def _lru_get(entries: OrderedDict, key):
+    value = entries.get(key)
+    if value is not None:
+        entries.move_to_end(key)
+    return value
+
+
+def _lru_put(entries: OrderedDict, key, value, size: int) -> None:
+    entries[key] = value
+    entries.move_to_end(key)
+    while len(entries) > size:
+        entries.popitem(last=False)
@@ -55,7 +55,7 @@ def _parse_character(things: dict, proto: CharacterProto):
     for state in _list(proto, 'states'):
         char.states.add(state)
     for item_name in _list(proto, 'inventory'):
-        char.inventory.add(things[item_name])
+        char.add_item(things[item_name])
     things[name] = char
 
 
@@ -64,7 +64,7 @@ def _parse_places(world: World, things: dict, protos: list[PlaceProto], prefix:
         place = Place(world, proto['name'], parent)
         for item_name in _list(proto, 'items'):
             item = things[item_name]
-            place.items.add(item)
+            place.add_item(item)
 
         _parse_places(world, things, _list(proto, 'children'), place.name + ".", place)
         things[prefix + place.name] = place
@@ -76,7 +76,7 @@ def _parse_places(world: World, things: dict, protos: list[PlaceProto], prefix:
             if place is None:
                 raise Exception(f"place {place_name} not found")
             exit = things[exit_name]
-            place.exits.add(exit)
+            place.add_exit(exit)
 
 
 def init_scene(world: World, scene_proto: SceneProto) -> dict:
@@ -0,0 +1,113 @@
+from __future__ import annotations
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from character import Character, Decision
+from world import World
+
+
+class Scheduler:
+    """ Ticks every character in the world at once.
+
+        A tick has three phases:
+        1. Every character perceives the world, so all of them decide from the same snapshot.
+        2. Every character decides, concurrently, so a tick takes about as long as the slowest call,
+           rather than the sum of all of them. By default every character's call is in flight at once;
+           pacing requests to what the provider allows is the chat backend's job (see LLMBackend's
+           rate_limit). Pass `concurrency` to also cap how many characters decide at a time, e.g. for a
+           local model that can only serve so many requests at once. Lore queries (which may each be a
+           round trip to a remote embedding model) run on the scheduler's own threads, one per decision
+           in flight, rather than on the event loop's default executor, which has only a few.
+        3. The decisions are applied one at a time, in a deterministic order (which does not depend on
+           which call finished first). Priority rotates by one character per tick, so no character
+           always goes first. When several characters try to take the same item, the first in that
+           order gets it, and the others are told who took it first. (If there are several items with
+           that name, that only happens once they have all been claimed.)
+    """
+    world: World
+    concurrency: int  # None for no limit
+    ticks: int
+    loop: asyncio.AbstractEventLoop
+    executor: ThreadPoolExecutor
+
+    def __init__(self, world: World, concurrency: int = None) -> None:
+        self.world = world
+        self.concurrency = concurrency
+        self.ticks = 0
+        self.loop = None
+        self.executor = None
+        self.workers = 0
+
+    def tick(self, debug=False) -> None:
+        """ Run one tick, on the scheduler's own event loop, which is kept between ticks so that backends can
+            reuse their connections. From inside a running event loop (e.g., a notebook), await tick_async() instead. """
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.tick_async(debug))
+
+    def close(self) -> None:
+        """ Stop the lore query threads, and close the event loop and the connections on it of every chat
+            backend in use: the world's, and any of the characters' own. """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+            self.workers = 0
+        if self.loop is None:
+            return
+        backends = {id(llm): llm for llm in [self.world.llm] + [char.llm for char in self.world.characters] if llm is not None}
+        for llm in backends.values():
+            if hasattr(llm, "aclose"):
+                self.loop.run_until_complete(llm.aclose())
+        self.loop.run_until_complete(self.loop.shutdown_default_executor())
+        self.loop.close()
+        self.loop = None
+
+    async def tick_async(self, debug=False) -> None:
+        characters = list(self.world.characters)
+        perceptions = [char.perceive() for char in characters]
+
+        workers = self.concurrency or max(len(characters), 1)
+        limit = asyncio.Semaphore(workers)
+        if workers > self.workers:
+            # (Re)sized as characters are added; threads are only started as they are needed.
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lore")
+            self.workers = workers
+
+        async def decide(char: Character, perception) -> Decision:
+            async with limit:
+                return await char.decide_async(perception, self.executor)
+
+        decisions = await asyncio.gather(*[decide(c, p) for c, p in zip(characters, perceptions)])
+
+        order = self._order(len(characters))
+        blocked = self._resolve([characters[i] for i in order], [decisions[i] for i in order])
+        for i in order:
+            characters[i].apply(decisions[i], debug, blocked.get(characters[i]))
+        self.ticks += 1
+
+    def _order(self, n: int) -> list[int]:
+        if n == 0:
+            return []
+        start = self.ticks % n
+        return list(range(start, n)) + list(range(start))
+
+    def _resolve(self, characters: list[Character], decisions: list[Decision]) -> dict[Character, str]:
+        """ Find the actions that lose a conflict, in priority order, against the world as perceived.
+            Returns the event each losing character gets instead of performing its action. """
+        blocked = {}
+        # Characters taking an item by each (place, name), in order; each one gets the next item of that name.
+        takers: dict[tuple[int, str], list[Character]] = {}
+        for char, decision in zip(characters, decisions):
+            [verb, item_name, child_name] = decision['action']
+            if verb != "take" or item_name is None:
+                continue
+            [items, place] = char.place.find_items(item_name, child_name)
+            if not items:
+                continue # It was never there; the action fails on its own.
+            claimed = takers.setdefault((id(place), item_name), [])
+            if len(claimed) < len(items):
+                claimed.append(char)
+            else:
+                blocked[char] = f"you tried to take {item_name}, but {claimed[-1].name} took it first"
+        return blocked
@@ -1,16 +1,58 @@
 from __future__ import annotations
+from llm import LLMBackend, OpenAIChat
 from lore import Lore
 
 
+class NameIndex:
+    """ Things with a name (items, places, characters), by name, for lookups that don't scan every one.
+        Several things may share a name; get() returns the first of them that was added. """
+    by_name: dict[str, dict[any, None]]
+
+    def __init__(self) -> None:
+        self.by_name = {}
+
+    def add(self, thing) -> None:
+        self.by_name.setdefault(thing.name, {})[thing] = None
+
+    def remove(self, thing) -> None:
+        things = self.by_name[thing.name]
+        del things[thing]
+        if not things:
+            del self.by_name[thing.name]
+
+    def get(self, name: str):
+        # Names come from the model's replies, parsed as literals, so they may be lists etc. (which can't be
+        # looked up, and, as with scan(), match nothing).
+        things = self.by_name.get(name) if isinstance(name, str) else None
+        return next(iter(things)) if things else None
+
+    def get_all(self, name: str) -> list:
+        return list(self.by_name.get(name, ())) if isinstance(name, str) else []
+
+
+def scan(things, name: str):
+    """ The first of things with the given name, or None: what a NameIndex lookup does, the slow way. """
+    for thing in things:
+        if thing.name == name:
+            return thing
+    return None
+
+
 class World:
     """ World class that owns all the places, items, and characters.
-        It also tracks global state like time-of-day. """
+        It also tracks global state like time-of-day, and the chat model characters think with. """
     lore: Lore
+    llm: LLMBackend
     time: str
+    characters: list["Character"]
+    indexed: bool  # False to find things by scanning, rather than with the places' and characters' NameIndexes
 
-    def __init__(self, lore: Lore) -> None:
+    def __init__(self, lore: Lore, llm: LLMBackend = None) -> None:
         self.lore = lore
+        self.llm = llm or OpenAIChat("gpt-4")
         self.time = "evening"
+        self.characters = []
+        self.indexed = True
 
     def __str__(self) -> str:
         return f"{self.time} in the world"
@@ -41,7 +83,9 @@ class Item:
 
 
 class Place:
-    """ A place is a location within the game. """
+    """ A place is a location within the game.
+        Its children, items, characters and exits are each indexed by name, so they should only be changed
+        through the methods below (add_item, remove_item, etc), which keep the indexes up to date. """
     name: str
     world: World
     parent: Place
@@ -49,10 +93,14 @@ class Place:
     items: set[Item]
     characters: set["Character"]
     exits: set[Place]
+    child_index: NameIndex
+    item_index: NameIndex
+    character_index: NameIndex
+    exit_index: NameIndex
 
     def connect(a: Place, b: Place) -> None:
-        a.exits.add(b)
-        b.exits.add(a)
+        a.add_exit(b)
+        b.add_exit(a)
 
     def __init__(self, world: World, name: str, parent: Place = None) -> None:
         self.name = name
@@ -60,12 +108,17 @@ class Place:
 
         self.parent = parent
         self.children = []
+        self.child_index = NameIndex()
         if parent:
             parent.children.append(self)
+            parent.child_index.add(self)
 
         self.items = set()
+        self.item_index = NameIndex()
         self.characters = set()
+        self.character_index = NameIndex()
         self.exits = set()
+        self.exit_index = NameIndex()
 
     def __str__(self) -> str:
         # TODO: This is nice for clarity, but currently breaks references when, e.g., the model says ['take', 'mug', "kitchen's table"]
@@ -78,7 +131,28 @@ class Place:
 
     def new_item(self, item: Item):
         """ Create a copy of an item and place it here. """
-        self.items.add(item.copy())
+        self.add_item(item.copy())
+
+    def add_item(self, item: Item) -> None:
+        self.items.add(item)
+        self.item_index.add(item)
+
+    def remove_item(self, item: Item) -> None:
+        self.items.remove(item)
+        self.item_index.remove(item)
+
+    def add_character(self, char: "Character") -> None:
+        self.characters.add(char)
+        self.character_index.add(char)
+
+    def remove_character(self, char: "Character") -> None:
+        self.characters.remove(char)
+        self.character_index.remove(char)
+
+    def add_exit(self, place: Place) -> None:
+        """ Add a one-way exit to another place; see connect() for two-way. """
+        self.exits.add(place)
+        self.exit_index.add(place)
 
     def available_exits(self) -> list[str]:
         """ Gets all available exits, by name. """
@@ -131,44 +205,46 @@ class Place:
             if place is None:
                 place = self
 
-        for item in place.items:
-            if item.name == name:
-                return [item, place]
+        item = place.item_index.get(name) if self.world.indexed else scan(place.items, name)
+        if item is None:
+            return [None, None]
+        return [item, place]
+
+    def find_items(self, name: str, child_name: str = None) -> list[list[Item], Place]:
+        """ Find every item with the given name where find_item() would look, in the order it would find them. """
+        place = self
+        if child_name:
+            place = self.child_by_name(child_name)
+            if place is None:
+                place = self
 
-        return [None, None]
+        if self.world.indexed:
+            return [place.item_index.get_all(name), place]
+        return [[item for item in place.items if item.name == name], place]
 
     def find_exit(self, name: str) -> Place:
         """ Find an exit name. This will search this place's exits and its parents.
             It will also include child places, but _not_ their exits. """
-        for place in self.exits:
-            if place.name == name:
-                return place
-        if self.parent:
-            for place in self.parent.exits:
-                if place.name == name:
-                    return place
-        return self.child_by_name(name)
+        indexed = self.world.indexed
+        place = self.exit_index.get(name) if indexed else scan(self.exits, name)
+        if place is None and self.parent:
+            place = self.parent.exit_index.get(name) if indexed else scan(self.parent.exits, name)
+        return place or self.child_by_name(name)
 
     def child_by_name(self, name: str) -> Place:
         """ Find a child place by name. """
-        for child in self.children:
-            if child.name == name:
-                return child
-        return None
+        return self.child_index.get(name) if self.world.indexed else scan(self.children, name)
 
     def find_character(self, name: str) -> Place:
         """ Find a character within this place, its parent or children, by name. """
-        for char in self.characters:
-            if char.name == name:
-                return char
+        places = [self]
         if self.parent:
-            for char in self.parent.characters:
-                if char.name == name:
-                    return char
-        for child in self.children:
-            for char in child.characters:
-                if char.name == name:
-                    return char
+            places.append(self.parent)
+        places.extend(self.children)
+        for place in places:
+            char = place.character_index.get(name) if self.world.indexed else scan(place.characters, name)
+            if char is not None:
+                return char
         return None
 
     def say(self, char: "Character", statement: str, listener: str = None) -> str:
@@ -185,7 +261,7 @@ class Place:
         if item is None:
             return f"you tried to take {item_name}, but couldn't find it"
 
-        place.items.remove(item)
+        place.remove_item(item)
         char.add_item(item)
 
         place.broadcast(f"{char.name} took {item.name} from {self.name}")
@@ -198,7 +274,7 @@ class Place:
             return f"you tried to put {item_name}, but didn't have it"
 
         char.remove_item(item)
-        self.items.add(item)
+        self.add_item(item)
 
         self.broadcast(f"{char.name} placed {item.name} in {self.name}")
         return None
@@ -239,8 +315,8 @@ class Place:
         if to_place is None:
             return f"you tried to move to {place_name}, but can't get there from here."
 
-        self.characters.remove(char)
-        to_place.characters.add(char)
+        self.remove_character(char)
+        to_place.add_character(char)
         char.place = to_place
 
         self.broadcast(f"{char.name} exited to {place_name}")
@@ -0,0 +1,3 @@
+# Importable library for the char-level GPT and bigram models in gpt.py and bigram.py.
+# config, model, attention, tokenizer, engine and data have no import-time side effects;
+# train, distributed, sample, score and bench are the command line entry points (python -m chargpt.train, ...).
@@ -0,0 +1,137 @@
+import torch
+import torch.nn as nn
+from torch.nn import functional as F
+
+class Head(nn.Module):
+    """ one head of self-attention """
+
+    def __init__(self, n_embd, head_size, block_size, dropout):
+        super().__init__()
+        self.key = nn.Linear(n_embd, head_size, bias=False)
+        self.query = nn.Linear(n_embd, head_size, bias=False)
+        self.value = nn.Linear(n_embd, head_size, bias=False)
+        self.register_buffer('tril', torch.tril(torch.ones(block_size, block_size)))
+
+        self.dropout = nn.Dropout(dropout)
+
+    def forward(self, x):
+        # input of size (batch, time-step, channels)
+        # output of size (batch, time-step, head size)
+        B,T,C = x.shape
+        k = self.key(x)   # (B,T,hs)
+        q = self.query(x) # (B,T,hs)
+        # compute attention scores ("affinities")
+        wei = q @ k.transpose(-2,-1) * k.shape[-1]**-0.5 # (B, T, hs) @ (B, hs, T) -> (B, T, T)
+        wei = wei.masked_fill(self.tril[:T, :T] == 0, float('-inf')) # (B, T, T)
+        wei = F.softmax(wei, dim=-1) # (B, T, T)
+        wei = self.dropout(wei)
+        # perform the weighted aggregation of the values
+        v = self.value(x) # (B,T,hs)
+        out = wei @ v # (B, T, T) @ (B, T, hs) -> (B, T, hs)
+        return out
+
+class MultiHeadAttention(nn.Module):
+    """ multiple heads of self-attention in parallel """
+
+    def __init__(self, n_embd, num_heads, head_size, block_size, dropout):
+        super().__init__()
+        self.heads = nn.ModuleList([Head(n_embd, head_size, block_size, dropout) for _ in range(num_heads)])
+        self.proj = nn.Linear(head_size * num_heads, n_embd)
+        self.dropout = nn.Dropout(dropout)
+
+    def forward(self, x, cache=None, mask=None):
+        assert cache is None and mask is None, 'per-head attention has no kv cache or masks, use CausalSelfAttention'
+        out = torch.cat([h(x) for h in self.heads], dim=-1)
+        out = self.dropout(self.proj(out))
+        return out
+
+class KVCache:
+    """ preallocated keys and values of one attention layer, for incremental decoding """
+
+    def __init__(self, batch_size, n_head, max_len, head_size, device=None, dtype=None):
+        self.k = torch.zeros(batch_size, n_head, max_len, head_size, device=device, dtype=dtype)
+        self.v = torch.zeros(batch_size, n_head, max_len, head_size, device=device, dtype=dtype)
+        self.pos = 0 # number of time steps filled so far
+
+    def reset(self):
+        self.pos = 0
+
+    def update(self, k, v):
+        # append (B, nh, T, hs) keys/values and return everything cached so far
+        T = k.size(2)
+        assert self.pos + T <= self.k.size(2), 'kv cache overflow'
+        self.k[:, :, self.pos:self.pos+T] = k
+        self.v[:, :, self.pos:self.pos+T] = v
+        self.pos += T
+        return self.k[:, :, :self.pos], self.v[:, :, :self.pos]
+
+class CausalSelfAttention(nn.Module):
+    """ all heads of self-attention in one batched pass
+
+    Computes the same function as MultiHeadAttention, but with a single fused
+    qkv projection and (B, nh, T, hs) attention instead of a python loop over
+    heads. Parameters load from MultiHeadAttention state dicts, so existing
+    GPTLanguageModel checkpoints keep working.
+    """
+
+    def __init__(self, n_embd, n_head, block_size, dropout, use_sdpa=True):
+        super().__init__()
+        assert n_embd % n_head == 0
+        self.n_head = n_head
+        self.dropout_p = dropout
+        self.use_sdpa = use_sdpa and hasattr(F, 'scaled_dot_product_attention')
+        # rows are laid out as [query; key; value], each (n_embd, n_embd) with heads stacked in order
+        self.qkv = nn.Linear(n_embd, 3 * n_embd, bias=False)
+        self.proj = nn.Linear(n_embd, n_embd)
+        self.register_buffer('tril', torch.tril(torch.ones(block_size, block_size)).bool(), persistent=False)
+        self.attn_dropout = nn.Dropout(dropout)
+        self.dropout = nn.Dropout(dropout)
+
+    def forward(self, x, cache=None, mask=None):
+        # with a cache, x holds only the new time steps; keys/values of earlier steps come from the cache.
+        # mask, if given, is a boolean (B, 1, T, S) tensor (True = may attend) that replaces the causal mask,
+        # e.g. to hide left padding in a batch of prompts of different lengths
+        B,T,C = x.shape
+        q, k, v = self.qkv(x).split(C, dim=2)
+        q = q.view(B, T, self.n_head, C // self.n_head).transpose(1, 2) # (B, nh, T, hs)
+        k = k.view(B, T, self.n_head, C // self.n_head).transpose(1, 2) # (B, nh, T, hs)
+        v = v.view(B, T, self.n_head, C // self.n_head).transpose(1, 2) # (B, nh, T, hs)
+        start = 0
+        if cache is not None:
+            start = cache.pos
+            k, v = cache.update(k, v) # (B, nh, S, hs), S = start + T
+        S = k.size(2)
+
+        # queries sit at positions start..start+T-1 and may look at keys up to their own position;
+        # a single new token sees the whole cache, so it needs no mask at all
+        causal = mask is None and T > 1 and start == 0
+        if mask is None and T > 1 and start > 0:
+            mask = self.tril[start:start+T, :S]
+        if self.use_sdpa:
+            dropout_p = self.dropout_p if self.training else 0.0
+            out = F.scaled_dot_product_attention(q, k, v, attn_mask=mask, dropout_p=dropout_p, is_causal=causal)
+        else:
+            wei = q @ k.transpose(-2,-1) * k.shape[-1]**-0.5 # (B, nh, T, S)
+            if causal:
+                mask = self.tril[:T, :T]
+            if mask is not None:
+                wei = wei.masked_fill(~mask, float('-inf'))
+            wei = F.softmax(wei, dim=-1)
+            wei = self.attn_dropout(wei)
+            out = wei @ v # (B, nh, T, hs)
+
+        out = out.transpose(1, 2).contiguous().view(B, T, C) # re-assemble all head outputs side by side
+        out = self.dropout(self.proj(out))
+        return out
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # checkpoints written with per-head MultiHeadAttention store heads.{i}.{query,key,value};
+        # stack them into the fused qkv weight before the regular loading runs
+        if prefix + 'qkv.weight' not in state_dict and prefix + 'heads.0.query.weight' in state_dict:
+            fused = []
+            for name in ('query', 'key', 'value'):
+                fused.extend(state_dict.pop(f'{prefix}heads.{i}.{name}.weight') for i in range(self.n_head))
+            for i in range(self.n_head):
+                state_dict.pop(f'{prefix}heads.{i}.tril', None)
+            state_dict[prefix + 'qkv.weight'] = torch.cat(fused, dim=0)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
@@ -0,0 +1,574 @@
+""" CPU micro-benchmarks for the char-level GPT.
+
+Run from the gpt/ directory, e.g.:
+
+    python -m chargpt.bench attention
+    python -m chargpt.bench generate
+    python -m chargpt.bench engine
+    python -m chargpt.bench loader
+    python -m chargpt.bench precision
+    python -m chargpt.bench ddp
+    python -m chargpt.bench tokenizer
+    python -m chargpt.bench quantize gpt.pt
+    python -m chargpt.bench suite --out bench.json
+    python -m chargpt.bench bigram
+
+`suite` is the regression benchmark: bigram vs GPT over a sweep of model
+sizes, with fixed seeds and hyperparameters, written out as a JSON report.
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+
+from chargpt.attention import MultiHeadAttention, CausalSelfAttention
+from chargpt.config import CONFIGS, BigramConfig, GPTConfig, autocast, init_device, synchronize
+from chargpt.checkpoint import load_model
+from chargpt.data import load_dataset, load_text, get_batch
+from chargpt.distributed import get_rank, get_world_size, launch, shard
+from chargpt.engine import GenerationEngine, Request
+from chargpt.evaluate import Evaluator, split_loss
+from chargpt.loader import PrefetchLoader
+from chargpt.metrics import peak_memory
+from chargpt.model import GPTLanguageModel, build_model
+from chargpt.quantize import quantize
+from chargpt.tokenizer import BPETokenizer, CharTokenizer
+from chargpt.train import make_grad_scaler, make_optimizer
+
+def _tokens_per_sec(fn, tokens, warmup, iters):
+    for _ in range(warmup):
+        fn()
+    t0 = time.perf_counter()
+    for _ in range(iters):
+        fn()
+    return tokens * iters / (time.perf_counter() - t0)
+
+def bench_attention(args):
+    """ tokens/sec of the per-head attention loop vs the fused module, forward and forward+backward """
+    torch.manual_seed(1337)
+    head_size = args.n_embd // args.n_head
+    variants = {
+        'heads': MultiHeadAttention(args.n_embd, args.n_head, head_size, args.block_size, args.dropout),
+        'fused': CausalSelfAttention(args.n_embd, args.n_head, args.block_size, args.dropout, use_sdpa=False),
+        'fused+sdpa': CausalSelfAttention(args.n_embd, args.n_head, args.block_size, args.dropout, use_sdpa=True),
+    }
+    # every variant computes the same function from the same weights
+    for name in ('fused', 'fused+sdpa'):
+        variants[name].load_state_dict(variants['heads'].state_dict())
+
+    x = torch.randn(args.batch_size, args.block_size, args.n_embd)
+    tokens = args.batch_size * args.block_size
+    with torch.no_grad():
+        ref = variants['heads'].eval()(x)
+    print(f"batch {args.batch_size} x block {args.block_size}, n_embd {args.n_embd}, n_head {args.n_head}, {torch.get_num_threads()} threads")
+    for name, module in variants.items():
+        module.eval()
+        with torch.no_grad():
+            err = (module(x) - ref).abs().max().item()
+            fwd = _tokens_per_sec(lambda: module(x), tokens, args.warmup, args.iters)
+        module.train()
+        def step():
+            module.zero_grad(set_to_none=True)
+            module(x).sum().backward()
+        train = _tokens_per_sec(step, tokens, args.warmup, args.iters)
+        print(f"{name:>12}: forward {fwd:10.0f} tok/s, forward+backward {train:10.0f} tok/s, max abs diff {err:.2e}")
+
+def bench_generate(args):
+    """ generate() tokens/sec with and without the kv cache, from an untrained GPT """
+    torch.manual_seed(1337)
+    config = GPTConfig(block_size=args.block_size, n_embd=args.n_embd, n_head=args.n_head, n_layer=args.n_layer)
+    model = GPTLanguageModel(config, args.vocab_size).eval()
+    context = torch.zeros((1, 1), dtype=torch.long)
+    samples = {}
+    for use_cache in (False, True):
+        torch.manual_seed(1337)
+        t0 = time.perf_counter()
+        samples[use_cache] = model.generate(context, args.tokens, use_cache=use_cache)[0].tolist()
+        dt = time.perf_counter() - t0
+        print(f"generate (kv cache {'on' if use_cache else 'off'}): {args.tokens / dt:.1f} tokens/sec")
+    same = next((i for i, (a, b) in enumerate(zip(samples[False], samples[True])) if a != b), len(samples[True]))
+    print(f"cached and uncached samples agree on the first {same} of {len(samples[True])} tokens")
+
+def bench_engine(args):
+    """ GenerationEngine tokens/sec for prompts run one at a time vs batched, checking that greedy outputs match """
+    torch.manual_seed(1337)
+    text = load_text(args.data)
+    tokenizer = CharTokenizer.from_text(text)
+    config = GPTConfig(block_size=args.block_size, n_embd=args.n_embd, n_head=args.n_head, n_layer=args.n_layer, dropout=0.0)
+    model = GPTLanguageModel(config, tokenizer.vocab_size).eval()
+    # prompts of different lengths, some longer than the window, and outputs long enough to slide it
+    lines = [line for line in text.splitlines() if line]
+    requests = [Request(' '.join(lines[i:i + i % 4 + 1]), args.tokens, temperature=0.0) for i in range(args.prompts)]
+    engine = lambda: GenerationEngine(model, tokenizer.encode, tokenizer.decode, args.block_size, max_batch_size=args.prompts)
+    t0 = time.perf_counter()
+    solo = [engine().generate([r])[0] for r in requests]
+    solo_time = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    batched = engine().generate(requests)
+    batched_time = time.perf_counter() - t0
+    assert batched == solo, 'batched greedy outputs differ from the same requests run alone'
+    tokens = args.prompts * args.tokens
+    print(f"{args.prompts} prompts x {args.tokens} tokens, block {args.block_size}, n_embd {args.n_embd}, n_layer {args.n_layer}")
+    print(f"one at a time: {tokens / solo_time:10.0f} tok/s")
+    print(f"      batched: {tokens / batched_time:10.0f} tok/s, greedy outputs identical")
+
+def bench_loader(args):
+    """ per-step data vs compute time of training, with batches built inline and prefetched """
+    device = init_device(args.device)
+    train_data, _, tokenizer = load_dataset(args.data)
+    config = GPTConfig(batch_size=args.batch_size, block_size=args.block_size, n_embd=args.n_embd,
+                       n_head=args.n_head, n_layer=args.n_layer)
+    print(f"batch {args.batch_size} x block {args.block_size}, n_embd {args.n_embd}, n_layer {args.n_layer} on {device}")
+    for depth in (0, args.depth):
+        torch.manual_seed(1337)
+        model = GPTLanguageModel(config, tokenizer.vocab_size).to(device)
+        optimizer = torch.optim.AdamW(model.parameters(), lr=config.learning_rate)
+        loader = PrefetchLoader(train_data, args.block_size, args.batch_size, device, depth) if depth else None
+        data_time = compute_time = 0.0
+        for i in range(args.warmup + args.iters):
+            t0 = time.perf_counter()
+            if loader is not None:
+                xb, yb = next(loader)
+            else:
+                xb, yb = get_batch(train_data, args.block_size, args.batch_size, device)
+            t1 = time.perf_counter()
+            logits, loss = model(xb, yb)
+            optimizer.zero_grad(set_to_none=True)
+            loss.backward()
+            optimizer.step()
+            synchronize(device)
+            if i >= args.warmup:
+                data_time += t1 - t0
+                compute_time += time.perf_counter() - t1
+        if loader is not None:
+            loader.close()
+        name = f"prefetch {depth}" if depth else 'inline'
+        print(f"{name:>12}: data {data_time / args.iters * 1e3:7.2f} ms/step, compute {compute_time / args.iters * 1e3:7.2f} ms/step, "
+              f"total {(data_time + compute_time) / args.iters * 1e3:7.2f} ms/step")
+
+def _precision_run(mode, args):
+    """ one short training run in a fresh process; returns its per-step losses, speed and peak memory """
+    dtype, _, compile = mode.partition('+')
+    device = init_device(args['device'])
+    train_data, _, tokenizer = load_dataset(args['data'])
+    config = GPTConfig(batch_size=args['batch_size'], block_size=args['block_size'], n_embd=args['n_embd'],
+                       n_head=args['n_head'], n_layer=args['n_layer'], dropout=args['dropout'],
+                       dtype=dtype, compile=compile == 'compile', device=args['device'])
+    torch.manual_seed(1337)
+    model = GPTLanguageModel(config, tokenizer.vocab_size).to(device)
+    optimizer = make_optimizer(model, config)
+    scaler = make_grad_scaler(config, device)
+    step_model = torch.compile(model) if config.compile else model
+    # every mode trains on the same batches from the same initial weights
+    generator = torch.Generator().manual_seed(1337)
+    losses = []
+    try:
+        for i in range(args['warmup'] + args['iters']):
+            if i == args['warmup']:
+                synchronize(device)
+                t0 = time.perf_counter()
+            xb, yb = get_batch(train_data, config.block_size, config.batch_size, device, generator)
+            with autocast(device, config.dtype):
+                logits, loss = step_model(xb, yb)
+            optimizer.zero_grad(set_to_none=True)
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+            losses.append(loss.item())
+    except Exception as e: # e.g. no compiler toolchain for torch.compile, or no kernels for this dtype
+        return {'error': f"{type(e).__name__}: {e}".splitlines()[0]}
+    synchronize(device)
+    return {'iters_per_sec': args['iters'] / (time.perf_counter() - t0), 'peak_memory': peak_memory(device),
+            'losses': losses, 'device': str(device), 'fused_adamw': optimizer.defaults.get('fused', False)}
+
+def bench_precision(args):
+    """ iterations/sec and peak memory of training per precision/compile mode, with a loss-parity check against float32 """
+    modes = args.modes.split(',')
+    if 'float32' not in modes:
+        modes.insert(0, 'float32')
+    # each mode runs in its own process, so peak RSS and compile caches are per mode
+    ctx = multiprocessing.get_context('spawn')
+    params = {k: v for k, v in vars(args).items() if k != 'fn'}
+    results = {}
+    for mode in modes:
+        with ctx.Pool(1) as pool:
+            results[mode] = pool.apply(_precision_run, (mode, params))
+    print(f"batch {args.batch_size} x block {args.block_size}, n_embd {args.n_embd}, n_layer {args.n_layer}, "
+          f"{args.warmup} warmup + {args.iters} timed steps on {results['float32'].get('device', args.device)}")
+    ref = results['float32'].get('losses')
+    failed = False
+    for mode, r in results.items():
+        if 'error' in r:
+            print(f"{mode:>18}: unavailable ({r['error']})")
+            continue
+        line = f"{mode:>18}: {r['iters_per_sec']:7.2f} it/s, peak memory {r['peak_memory'] / 2**20:8.1f} MiB, final loss {r['losses'][-1]:.4f}"
+        if ref is not None and mode != 'float32':
+            diff = max(abs(a - b) for a, b in zip(r['losses'], ref))
+            ok = diff <= args.tolerance
+            failed |= not ok
+            line += f", max |loss - float32| {diff:.4f} {'ok' if ok else 'FAIL'}"
+        print(line)
+    if failed:
+        sys.exit(f"loss diverged from float32 by more than {args.tolerance}")
+
+def _ddp_run(args, results):
+    """ one rank of a data-parallel training run; rank 0 puts the timed seconds into `results` """
+    rank, world_size = get_rank(), get_world_size()
+    train_data, _, tokenizer = load_dataset(args['data'])
+    config = GPTConfig(batch_size=args['batch_size'], block_size=args['block_size'], n_embd=args['n_embd'],
+                       n_head=args['n_head'], n_layer=args['n_layer'], grad_accum=args['grad_accum'])
+    torch.manual_seed(1337)
+    model = GPTLanguageModel(config, tokenizer.vocab_size)
+    ddp = DistributedDataParallel(model) if world_size > 1 else None
+    optimizer = make_optimizer(model, config)
+    data = shard(train_data, rank, world_size)
+    generator = torch.Generator().manual_seed(1337 + rank)
+    for i in range(args['warmup'] + args['iters']):
+        if i == args['warmup']:
+            if ddp is not None:
+                dist.barrier()
+            t0 = time.perf_counter()
+        optimizer.zero_grad(set_to_none=True)
+        for micro in range(config.grad_accum):
+            xb, yb = get_batch(data, config.block_size, config.batch_size, 'cpu', generator)
+            sync = ddp.no_sync() if ddp is not None and micro < config.grad_accum - 1 else contextlib.nullcontext()
+            with sync:
+                logits, loss = (ddp or model)(xb, yb)
+                (loss / config.grad_accum).backward()
+        optimizer.step()
+    if rank == 0:
+        results.put(time.perf_counter() - t0)
+
+def bench_ddp(args):
+    """ training throughput of DistributedDataParallel over gloo with 1, 2, 4, ... processes on the cpu """
+    params = {k: v for k, v in vars(args).items() if k != 'fn'}
+    results = torch.multiprocessing.get_context('spawn').SimpleQueue()
+    tokens = args.batch_size * args.block_size * args.grad_accum
+    print(f"batch {args.batch_size} x block {args.block_size} x grad_accum {args.grad_accum} per process, "
+          f"n_embd {args.n_embd}, n_layer {args.n_layer}, {os.cpu_count()} cores")
+    base = None
+    for nproc in (int(n) for n in args.procs.split(',')):
+        threads = args.threads or max(1, (os.cpu_count() or 1) // nproc)
+        launch(_ddp_run, nproc, params, results, threads=threads)
+        elapsed = results.get()
+        rate = tokens * nproc * args.iters / elapsed
+        base = base or rate / nproc
+        print(f"{nproc:3d} x {threads:2d} threads: {args.iters / elapsed:6.2f} steps/s, {rate:9.0f} tokens/s, "
+              f"speedup {rate / base:5.2f}, efficiency {rate / base / nproc:4.0%}")
+
+def _seconds(fn):
+    t0 = time.perf_counter()
+    out = fn()
+    return out, time.perf_counter() - t0
+
+def bench_tokenizer(args):
+    """ encode/decode speed of the char and BPE vocabularies, and how much text block_size tokens cover """
+    text = load_text(args.data)
+    n = int(0.9*len(text))
+    train_text, val_text = text[:n], text[n:]
+    chars = sorted(set(text))
+    # the per-character dict lookups the scripts used before chargpt.tokenizer, for reference
+    stoi = {ch: i for i, ch in enumerate(chars)}
+    itos = {i: ch for i, ch in enumerate(chars)}
+    tokenizers = {'char (dicts)': None, 'char': CharTokenizer(chars)}
+    for vocab_size in (int(v) for v in args.vocab_sizes.split(',')):
+        tokenizers[f"bpe {vocab_size}"], seconds = _seconds(lambda: BPETokenizer.train(train_text, vocab_size))
+        print(f"bpe {vocab_size}: learned {vocab_size - 256} merges from {len(train_text)} chars in {seconds:.2f}s")
+    lines = val_text.splitlines(keepends=True)
+    print(f"{len(val_text)} val chars, block_size {args.block_size}")
+    for name, tokenizer in tokenizers.items():
+        if tokenizer is None:
+            ids, enc = _seconds(lambda: [stoi[c] for c in val_text])
+            _, dec = _seconds(lambda: ''.join([itos[i] for i in ids]))
+            batch = ''
+        else:
+            ids, enc = _seconds(lambda: tokenizer.encode(val_text))
+            _, dec = _seconds(lambda: tokenizer.decode(ids))
+            assert tokenizer.decode(ids) == val_text
+            seqs, batch_enc = _seconds(lambda: tokenizer.encode_batch(lines))
+            _, batch_dec = _seconds(lambda: tokenizer.decode_batch(seqs))
+            assert tokenizer.decode_batch(seqs) == lines
+            batch = f", {len(lines)}-line batch encode {batch_enc * 1e3:.1f} ms / decode {batch_dec * 1e3:.1f} ms"
+        per_token = len(val_text) / len(ids)
+        print(f"{name:>14}: encode {len(ids) / enc / 1e6:6.2f}M tok/s ({len(val_text) / enc / 1e6:6.2f}M chars/s), "
+              f"decode {len(ids) / dec / 1e6:6.2f}M tok/s, {per_token:.2f} chars/token, "
+              f"block covers {args.block_size * per_token:.0f} chars{batch}")
+
+def _state_bytes(model):
+    """ bytes of weights in a state dict, counting packed int8 linear weights too """
+    total = 0
+    for value in model.state_dict().values():
+        for t in (value if isinstance(value, tuple) else (value,)):
+            if isinstance(t, torch.Tensor):
+                total += t.numel() * t.element_size()
+    return total
+
+def bench_quantize(args):
+    """ float32 vs dynamically quantized int8 inference on the cpu: weight size, forward tokens/sec and generation latency """
+    torch.set_num_threads(args.threads or torch.get_num_threads())
+    models = {'float32': load_model(args.checkpoint, 'cpu')[0]}
+    models['int8'] = quantize(load_model(args.checkpoint, 'cpu')[0])
+    config = models['float32'].config
+    vocab_size = models['float32'].lm_head.out_features
+    idx = torch.randint(vocab_size, (args.batch_size, config.block_size), generator=torch.Generator().manual_seed(1337))
+    context = torch.zeros((1, 1), dtype=torch.long)
+    print(f"batch {args.batch_size} x block {config.block_size}, n_embd {config.n_embd}, n_layer {config.n_layer}, "
+          f"{torch.get_num_threads()} threads")
+    for name, model in models.items():
+        with torch.inference_mode():
+            forward = _tokens_per_sec(lambda: model(idx), idx.numel(), args.warmup, args.iters)
+            generate = _tokens_per_sec(lambda: model.generate(context, args.tokens), args.tokens, 1, 1)
+        print(f"{name:>8}: weights {_state_bytes(model) / 2**20:6.1f} MiB, forward {forward:9.0f} tokens/s, "
+              f"generate {1e3 / generate:6.2f} ms/token")
+
+def _suite_run(model_type, sizes, args):
+    """ train, eval and generate measurements of one model configuration, in a fresh process """
+    torch.set_num_threads(args['threads'])
+    train_data, val_data, tokenizer = load_dataset(args['data'])
+    config = CONFIGS[model_type](batch_size=args['batch_size'], eval_iters=args['eval_iters'], device='cpu', **sizes)
+    torch.manual_seed(1337)
+    model = build_model(model_type, config, tokenizer.vocab_size)
+    optimizer = make_optimizer(model, config)
+    generator = torch.Generator().manual_seed(1337)
+
+    def step():
+        xb, yb = get_batch(train_data, config.block_size, config.batch_size, 'cpu', generator)
+        logits, loss = model(xb, yb)
+        optimizer.zero_grad(set_to_none=True)
+        loss.backward()
+        optimizer.step()
+    steps_per_sec = _tokens_per_sec(step, 1, args['warmup'], args['iters'])
+
+    evaluator = Evaluator({'val': val_data}, config, 'cpu')
+    _, eval_seconds = _seconds(lambda: evaluator(model))
+
+    model.eval()
+    generate = {}
+    for length in sorted({1, config.block_size // 2, config.block_size}):
+        context = torch.randint(tokenizer.vocab_size, (1, length), generator=generator)
+        torch.manual_seed(1337)
+        _, first = _seconds(lambda: model.generate(context, 1))
+        _, total = _seconds(lambda: model.generate(context, args['tokens'] + 1))
+        generate[length] = {'first_token_ms': first * 1e3, 'ms_per_token': (total - first) / args['tokens'] * 1e3}
+    return {
+        'model': model_type,
+        **sizes,
+        'params': sum(p.numel() for p in model.parameters()),
+        'train_steps_per_sec': steps_per_sec,
+        'train_tokens_per_sec': steps_per_sec * config.batch_size * config.block_size,
+        'eval_ms': eval_seconds * 1e3,
+        'eval_ms_per_window': eval_seconds * 1e3 / (config.eval_iters * config.batch_size),
+        'generate': generate,
+        'peak_rss_mb': peak_memory(torch.device('cpu')) / 2**20,
+    }
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench_suite(args):
+    """ bigram vs GPT train steps/sec, eval cost, generate latency and peak memory over a size sweep, as a JSON report """
+    ints = lambda s: [int(v) for v in s.split(',')]
+    runs = [('bigram', {'block_size': b}) for b in ints(args.block_size)]
+    runs += [('gpt', {'n_embd': e, 'n_layer': l, 'block_size': b, 'n_head': args.n_head})
+             for e, l, b in itertools.product(ints(args.n_embd), ints(args.n_layer), ints(args.block_size))]
+    params = {k: v for k, v in vars(args).items() if k != 'fn'}
+    params['threads'] = args.threads or torch.get_num_threads()
+    # every configuration runs in its own process, so peak RSS is its own
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for model_type, sizes in runs:
+        with ctx.Pool(1) as pool:
+            r = pool.apply(_suite_run, (model_type, sizes, params))
+        results.append(r)
+        longest = r['generate'][max(r['generate'])]
+        name = ' '.join(f"{k}={v}" for k, v in sizes.items())
+        print(f"{model_type:>6} {name:44}: {r['params']:9d} params, {r['train_steps_per_sec']:7.2f} steps/s, "
+              f"eval {r['eval_ms']:8.1f} ms, generate {longest['ms_per_token']:6.2f} ms/token at full context, "
+              f"peak {r['peak_rss_mb']:6.0f} MiB")
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_revision': _git_revision(),
+        'torch': torch.__version__,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'threads': params['threads'],
+        'settings': {k: params[k] for k in ('data', 'batch_size', 'eval_iters', 'warmup', 'iters', 'tokens')},
+        'results': results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.out}")
+
+def bench_bigram(args):
+    """ bigram fit by SGD vs closed-form counts (fit time, exact val loss), and sampling via generate vs table lookups """
+    torch.set_num_threads(args.threads or torch.get_num_threads())
+    train_data, val_data, tokenizer = load_dataset(args.data)
+    V = tokenizer.vocab_size
+    config = BigramConfig(max_iters=args.sgd_iters, device='cpu', prefetch=0)
+    print(f"{len(train_data)} train / {len(val_data)} val tokens, vocab {V}, {torch.get_num_threads()} threads")
+
+    # every loss below is over the whole val split, not an estimate
+    torch.manual_seed(1337)
+    sgd = build_model('bigram', config, V)
+    optimizer = make_optimizer(sgd, config)
+    generator = torch.Generator().manual_seed(1337)
+    def fit_sgd():
+        for _ in range(config.max_iters):
+            xb, yb = get_batch(train_data, config.block_size, config.batch_size, 'cpu', generator)
+            logits, loss = sgd(xb, yb)
+            optimizer.zero_grad(set_to_none=True)
+            loss.backward()
+            optimizer.step()
+    _, seconds = _seconds(fit_sgd)
+    print(f"{'sgd':>14}: fit {seconds * 1e3:9.1f} ms ({config.max_iters} steps), "
+          f"val loss {split_loss(sgd, val_data, config.block_size):.4f}")
+    for smoothing in (float(v) for v in args.smoothing.split(',')):
+        model = build_model('bigram', config, V)
+        _, seconds = _seconds(lambda: model.fit_counts(train_data, smoothing))
+        print(f"{f'counts k={smoothing:g}':>14}: fit {seconds * 1e3:9.1f} ms, "
+              f"val loss {split_loss(model, val_data, config.block_size):.4f}")
+
+    context = torch.zeros((args.batch_size, 1), dtype=torch.long)
+    model.eval()
+    samplers = {'generate': lambda: model.generate(context, args.tokens),
+                'table lookup': lambda: model.generate_table(context, args.tokens)}
+    print(f"sampling {args.batch_size} sequences x {args.tokens} tokens:")
+    for name, fn in samplers.items():
+        rate = _tokens_per_sec(fn, args.batch_size * args.tokens, 1, args.iters)
+        print(f"{name:>14}: {rate:12.0f} tokens/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    p = sub.add_parser('attention', help=bench_attention.__doc__)
+    p.add_argument('--batch-size', type=int, default=16)
+    p.add_argument('--block-size', type=int, default=256)
+    p.add_argument('--n-embd', type=int, default=384)
+    p.add_argument('--n-head', type=int, default=6)
+    p.add_argument('--dropout', type=float, default=0.2)
+    p.add_argument('--warmup', type=int, default=2)
+    p.add_argument('--iters', type=int, default=10)
+    p.set_defaults(fn=bench_attention)
+
+    p = sub.add_parser('generate', help=bench_generate.__doc__)
+    p.add_argument('--tokens', type=int, default=500)
+    p.add_argument('--vocab-size', type=int, default=65)
+    p.add_argument('--block-size', type=int, default=256)
+    p.add_argument('--n-embd', type=int, default=384)
+    p.add_argument('--n-head', type=int, default=6)
+    p.add_argument('--n-layer', type=int, default=6)
+    p.set_defaults(fn=bench_generate)
+
+    p = sub.add_parser('engine', help=bench_engine.__doc__)
+    p.add_argument('--data', default='input.txt', help='text file the prompts and vocabulary come from')
+    p.add_argument('--prompts', type=int, default=16)
+    p.add_argument('--tokens', type=int, default=100, help='tokens generated per prompt')
+    p.add_argument('--block-size', type=int, default=64)
+    p.add_argument('--n-embd', type=int, default=128)
+    p.add_argument('--n-head', type=int, default=4)
+    p.add_argument('--n-layer', type=int, default=4)
+    p.set_defaults(fn=bench_engine)
+
+    p = sub.add_parser('loader', help=bench_loader.__doc__)
+    p.add_argument('--data', default='input.txt', help='text file or chargpt.prepare directory')
+    p.add_argument('--depth', type=int, default=2, help='prefetch queue depth')
+    p.add_argument('--device', default='auto')
+    p.add_argument('--batch-size', type=int, default=64)
+    p.add_argument('--block-size', type=int, default=256)
+    p.add_argument('--n-embd', type=int, default=384)
+    p.add_argument('--n-head', type=int, default=6)
+    p.add_argument('--n-layer', type=int, default=6)
+    p.add_argument('--warmup', type=int, default=2)
+    p.add_argument('--iters', type=int, default=10)
+    p.set_defaults(fn=bench_loader)
+
+    p = sub.add_parser('precision', help=bench_precision.__doc__)
+    p.add_argument('--modes', default='float32,bfloat16,float32+compile,bfloat16+compile',
+                   help='comma-separated dtype[+compile] modes; float32 is always run as the reference')
+    p.add_argument('--data', default='input.txt', help='text file or chargpt.prepare directory')
+    p.add_argument('--device', default='cpu')
+    p.add_argument('--batch-size', type=int, default=16)
+    p.add_argument('--block-size', type=int, default=128)
+    p.add_argument('--n-embd', type=int, default=192)
+    p.add_argument('--n-head', type=int, default=6)
+    p.add_argument('--n-layer', type=int, default=4)
+    p.add_argument('--dropout', type=float, default=0.0, help='0 keeps the runs comparable step for step')
+    p.add_argument('--warmup', type=int, default=3, help='untimed steps, which include compilation')
+    p.add_argument('--iters', type=int, default=20)
+    p.add_argument('--tolerance', type=float, default=0.05, help='largest per-step loss difference from float32 that passes')
+    p.set_defaults(fn=bench_precision)
+
+    p = sub.add_parser('ddp', help=bench_ddp.__doc__)
+    p.add_argument('--procs', default='1,2,4,8', help='comma-separated process counts to run')
+    p.add_argument('--threads', type=int, default=None, help='torch threads per process (default: cores / processes)')
+    p.add_argument('--data', default='input.txt', help='text file or chargpt.prepare directory')
+    p.add_argument('--batch-size', type=int, default=16, help='per process')
+    p.add_argument('--block-size', type=int, default=128)
+    p.add_argument('--grad-accum', type=int, default=1)
+    p.add_argument('--n-embd', type=int, default=192)
+    p.add_argument('--n-head', type=int, default=6)
+    p.add_argument('--n-layer', type=int, default=4)
+    p.add_argument('--warmup', type=int, default=2)
+    p.add_argument('--iters', type=int, default=10)
+    p.set_defaults(fn=bench_ddp)
+
+    p = sub.add_parser('tokenizer', help=bench_tokenizer.__doc__)
+    p.add_argument('--data', default='input.txt', help='text file')
+    p.add_argument('--vocab-sizes', default='512,1024', help='comma-separated BPE vocabulary sizes')
+    p.add_argument('--block-size', type=int, default=256)
+    p.set_defaults(fn=bench_tokenizer)
+
+    p = sub.add_parser('quantize', help=bench_quantize.__doc__)
+    p.add_argument('checkpoint', help='float32 checkpoint written by chargpt.train --out')
+    p.add_argument('--batch-size', type=int, default=8)
+    p.add_argument('--tokens', type=int, default=200, help='tokens to generate for the latency measurement')
+    p.add_argument('--threads', type=int, default=None)
+    p.add_argument('--warmup', type=int, default=2)
+    p.add_argument('--iters', type=int, default=10)
+    p.set_defaults(fn=bench_quantize)
+
+    p = sub.add_parser('suite', help=bench_suite.__doc__)
+    p.add_argument('--out', default='bench.json', help='JSON report to write')
+    p.add_argument('--data', default='input.txt', help='text file or chargpt.prepare directory')
+    p.add_argument('--n-embd', default='64,128', help='comma-separated sweep values (GPT only)')
+    p.add_argument('--n-layer', default='2,4', help='comma-separated sweep values (GPT only)')
+    p.add_argument('--block-size', default='64,128', help='comma-separated sweep values')
+    p.add_argument('--n-head', type=int, default=4)
+    p.add_argument('--batch-size', type=int, default=16)
+    p.add_argument('--eval-iters', type=int, default=10, help='eval windows are eval_iters * batch_size per split')
+    p.add_argument('--tokens', type=int, default=32, help='tokens generated per latency measurement')
+    p.add_argument('--threads', type=int, default=None)
+    p.add_argument('--warmup', type=int, default=2)
+    p.add_argument('--iters', type=int, default=10)
+    p.set_defaults(fn=bench_suite)
+
+    p = sub.add_parser('bigram', help=bench_bigram.__doc__)
+    p.add_argument('--data', default='input.txt', help='text file or chargpt.prepare directory')
+    p.add_argument('--sgd-iters', type=int, default=3000, help='AdamW steps of the SGD fit (the bigram default)')
+    p.add_argument('--smoothing', default='0.01,0.1,1', help='comma-separated add-k values for the counts fit')
+    p.add_argument('--batch-size', type=int, default=64, help='sequences sampled at once')
+    p.add_argument('--tokens', type=int, default=256, help='tokens sampled per sequence')
+    p.add_argument('--threads', type=int, default=None)
+    p.add_argument('--iters', type=int, default=5)
+    p.set_defaults(fn=bench_bigram)
+
+    args = parser.parse_args()
+    args.fn(args)
+
+if __name__ == '__main__':
+    main()
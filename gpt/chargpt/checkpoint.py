@@ -0,0 +1,88 @@
+""" Training checkpoints: model, optimizer, RNG state, iteration counter and tokenizer in one file.
+
+Checkpoints are written atomically (to a temp file, then renamed), so a run
+killed mid-save leaves the previous checkpoint intact. Loading memory-maps the
+file where torch supports it, so several inference processes on one machine
+share the weights through the page cache instead of each holding a copy.
+"""
+import inspect
+import os
+from dataclasses import asdict
+
+import torch
+
+from chargpt.config import CONFIGS, init_device
+from chargpt.model import build_model
+from chargpt.tokenizer import CharTokenizer, from_state
+
+_LOAD_MMAP = 'mmap' in inspect.signature(torch.load).parameters
+_LOAD_ASSIGN = 'assign' in inspect.signature(torch.nn.Module.load_state_dict).parameters
+
+def get_rng_state():
+    state = {'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    if torch.backends.mps.is_available() and hasattr(torch, 'mps'):
+        state['mps'] = torch.mps.get_rng_state()
+    return state
+
+def set_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+    if 'mps' in state and torch.backends.mps.is_available():
+        torch.mps.set_rng_state(state['mps'])
+
+def save_checkpoint(path, model_type, config, tokenizer, model, optimizer=None, iter=None, loader_state=None, scaler=None):
+    """ save everything needed to resume training at iteration `iter` (the next step to run) """
+    ckpt = {
+        'model_type': model_type,
+        'config': asdict(config),
+        'tokenizer': tokenizer.state_dict(),
+        'model': model.state_dict(),
+    }
+    if optimizer is not None:
+        ckpt['optimizer'] = optimizer.state_dict()
+        ckpt['iter'] = iter
+        ckpt['rng'] = get_rng_state()
+    if loader_state is not None:
+        ckpt['loader'] = loader_state
+    if scaler is not None and scaler.is_enabled():
+        ckpt['scaler'] = scaler.state_dict()
+    tmp = f"{path}.tmp"
+    torch.save(ckpt, tmp)
+    os.replace(tmp, path)
+
+def load_checkpoint(path, mmap=True):
+    """ load a checkpoint onto the cpu, memory-mapped if possible """
+    kwargs = {'mmap': True} if mmap and _LOAD_MMAP else {}
+    return torch.load(path, map_location='cpu', **kwargs)
+
+def tokenizer_from_checkpoint(ckpt):
+    # checkpoints saved before tokenizers were pluggable hold the character vocabulary instead
+    return from_state(ckpt['tokenizer']) if 'tokenizer' in ckpt else CharTokenizer(ckpt['chars'])
+
+def model_from_checkpoint(ckpt, device='cpu'):
+    """ rebuild the model stored in a loaded checkpoint; returns (model, tokenizer) """
+    config = CONFIGS[ckpt['model_type']](**ckpt['config'])
+    tokenizer = tokenizer_from_checkpoint(ckpt)
+    model = build_model(ckpt['model_type'], config, tokenizer.vocab_size)
+    device = init_device(device)
+    if ckpt.get('quantized'):
+        # written by chargpt.quantize: rebuild the same int8 modules, then fill in their packed weights
+        from chargpt.quantize import quantize
+        if device.type != 'cpu':
+            raise ValueError('quantized models run on the cpu only')
+        model = quantize(model)
+        model.load_state_dict(ckpt['model'])
+    elif device.type == 'cpu' and _LOAD_ASSIGN:
+        # adopt the (memory-mapped) checkpoint tensors as parameters instead of copying into fresh ones
+        model.load_state_dict(ckpt['model'], assign=True)
+    else:
+        model.load_state_dict(ckpt['model'])
+        model.to(device)
+    return model.eval(), tokenizer
+
+def load_model(path, device='auto', mmap=True):
+    """ load a model for inference from a checkpoint file; returns (model, tokenizer) """
+    return model_from_checkpoint(load_checkpoint(path, mmap), device)
@@ -0,0 +1,102 @@
+import sys
+from dataclasses import dataclass, fields
+from pathlib import Path
+
+@dataclass
+class GPTConfig:
+    """ hyperparameters of the GPT model and its training run """
+    batch_size: int = 64 # how many independent sequences will we process in parallel?
+    block_size: int = 256 # what is the maximum context length for predictions?
+    max_iters: int = 5000
+    eval_interval: int = 500
+    learning_rate: float = 3e-4
+    eval_iters: int = 200 # loss estimates average eval_iters * batch_size fixed windows per split
+    eval_batch_size: int = 512 # windows per forward pass during evaluation
+    async_eval: bool = False # evaluate each checkpoint in a separate process instead of pausing training
+    n_embd: int = 384
+    n_head: int = 6
+    n_layer: int = 6
+    dropout: float = 0.2
+    fused_attention: bool = True # one qkv projection for all heads instead of a Head module per head
+    use_sdpa: bool = True # use F.scaled_dot_product_attention in the fused path
+    seed: int = 1337
+    device: str = 'auto' # 'auto' picks the best available accelerator via mpt/gpu.py
+    checkpoint_interval: int = 500 # steps between checkpoints, when training with --out
+    prefetch: int = 2 # batches prepared ahead on a background thread, 0 to build them inline
+    grad_accum: int = 1 # batches whose gradients are summed into each optimizer step
+    dtype: str = 'float32' # autocast dtype for training: 'float32', 'bfloat16' or 'float16'
+    compile: bool = False # torch.compile the model for training
+    fused_adamw: bool = True # use the fused AdamW kernel where the device supports it
+
+@dataclass
+class BigramConfig:
+    """ hyperparameters of the bigram model and its training run """
+    batch_size: int = 32 # how many independent sequences will we process in parallel?
+    block_size: int = 8 # what is the maximum context length for predictions?
+    max_iters: int = 3000
+    eval_interval: int = 300
+    learning_rate: float = 1e-2
+    eval_iters: int = 200
+    eval_batch_size: int = 512
+    async_eval: bool = False
+    seed: int = 1337
+    device: str = 'auto'
+    checkpoint_interval: int = 500
+    prefetch: int = 2
+    grad_accum: int = 1
+    dtype: str = 'float32'
+    compile: bool = False
+    fused_adamw: bool = True
+    fit: str = 'sgd' # 'sgd' trains the table with AdamW; 'counts' sets it from bigram counts in one pass over the data
+    smoothing: float = 1.0 # add-k smoothing of the bigram counts for fit='counts'
+
+CONFIGS = {'gpt': GPTConfig, 'bigram': BigramConfig}
+
+def init_device(name='auto'):
+    """ resolve a config's device name, deferring to mpt/gpu.py:init_gpu for 'auto' """
+    import torch
+    if name != 'auto':
+        return torch.device(name)
+    mpt = str(Path(__file__).resolve().parents[2] / 'mpt')
+    if mpt not in sys.path:
+        sys.path.append(mpt)
+    from gpu import init_gpu
+    return init_gpu()
+
+def synchronize(device):
+    """ wait for queued work on an accelerator, so host-side timings are accurate """
+    import torch
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    elif device.type == 'mps':
+        torch.mps.synchronize()
+
+DTYPES = ('float32', 'bfloat16', 'float16')
+
+def autocast(device, dtype='float32'):
+    """ mixed precision context for the forward pass; a no-op for float32 """
+    import contextlib
+    import torch
+    if dtype not in DTYPES:
+        raise ValueError(f"unknown dtype {dtype!r}, expected one of {', '.join(DTYPES)}")
+    if dtype == 'float32':
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device.type, dtype=getattr(torch, dtype))
+
+def _parse_bool(s):
+    return s.lower() in ('1', 'true', 'yes', 'on')
+
+def add_config_args(parser, cls):
+    """ add a --flag for every field of a config dataclass, defaulting to None (= keep the config default) """
+    for f in fields(cls):
+        kind = _parse_bool if f.type in (bool, 'bool') else type(f.default)
+        parser.add_argument('--' + f.name.replace('_', '-'), dest=f.name, type=kind, default=None)
+
+def config_from_args(cls, args, base=None):
+    """ build a config from parsed args, overriding only the flags that were given """
+    config = base if base is not None else cls()
+    for f in fields(cls):
+        value = getattr(args, f.name, None)
+        if value is not None:
+            setattr(config, f.name, value)
+    return config
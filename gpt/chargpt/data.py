@@ -0,0 +1,113 @@
+import json
+import os
+
+import numpy as np
+import torch
+
+from chargpt.tokenizer import BPETokenizer, CharTokenizer, from_state, token_dtype
+
+def load_text(path='input.txt'):
+    # wget https://raw.githubusercontent.com/karpathy/char-rnn/master/data/tinyshakespeare/input.txt
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def split_data(data, train_frac=0.9):
+    # Train and test splits
+    n = int(train_frac*len(data)) # first 90% will be train, rest val
+    return data[:n], data[n:]
+
+def get_windows(data, block_size, n, generator=None):
+    """ n random windows of block_size+1 tokens, as an (n, block_size+1) tensor in data's own dtype """
+    ix = torch.randint(len(data) - block_size, (n,), generator=generator)
+    return windows_at(data, ix, block_size)
+
+def windows_at(data, ix, block_size):
+    """ the windows of block_size+1 tokens starting at each offset in ix, as a (len(ix), block_size+1) tensor """
+    # data is a 1-d tensor or a numpy array/memmap of token ids; every window is cut out by one gather
+    offsets = ix.unsqueeze(1) + torch.arange(block_size + 1) # (n, T+1)
+    if isinstance(data, np.ndarray):
+        windows = data[offsets.numpy()]
+        return torch.from_numpy(windows.astype(np.int32) if windows.dtype == np.uint16 else windows)
+    return data[offsets]
+
+def get_batch(data, block_size, batch_size, device, generator=None):
+    # generate a small batch of data of inputs x and targets y
+    buf = get_windows(data, block_size, batch_size, generator).long()
+    x = buf[:, :-1].contiguous()
+    y = buf[:, 1:].contiguous()
+    x, y = x.to(device), y.to(device)
+    return x, y
+
+# Pre-tokenized datasets: a directory with train.bin and val.bin (token ids as raw uint8/uint16,
+# whichever fits the vocab) plus a meta.json sidecar holding the tokenizer. The .bin files are
+# memory-mapped at training time, so the corpus never has to fit in memory.
+
+def _read_chunks(path, chunk_size):
+    with open(path, 'r', encoding='utf-8') as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+def prepare(text_path, out_dir, train_frac=0.9, chunk_size=1 << 24, bpe_vocab_size=None):
+    """ tokenize a text file into out_dir/{train,val}.bin and out_dir/meta.json, streaming it in chunks
+
+    With bpe_vocab_size, a byte-level BPE is learned from the first chunk_size
+    characters of the train split instead of using the character vocabulary.
+    """
+    # first pass: vocabulary and length
+    chars, total = set(), 0
+    for chunk in _read_chunks(text_path, chunk_size):
+        chars.update(chunk)
+        total += len(chunk)
+    n = int(train_frac*total)
+    if bpe_vocab_size:
+        tokenizer = BPETokenizer.train(next(_read_chunks(text_path, chunk_size), '')[:n], bpe_vocab_size)
+    else:
+        tokenizer = CharTokenizer(sorted(chars))
+    dtype = token_dtype(tokenizer.vocab_size)
+
+    # second pass: encode, sending the first train_frac of the text to train.bin, the rest to val.bin
+    os.makedirs(out_dir, exist_ok=True)
+    written = train_tokens = val_tokens = 0
+    with open(os.path.join(out_dir, 'train.bin'), 'wb') as train_f, open(os.path.join(out_dir, 'val.bin'), 'wb') as val_f:
+        for chunk in _read_chunks(text_path, chunk_size):
+            cut = max(0, min(len(chunk), n - written))
+            train_ids, val_ids = tokenizer.encode_batch([chunk[:cut], chunk[cut:]], dtype)
+            train_ids.tofile(train_f)
+            val_ids.tofile(val_f)
+            train_tokens += len(train_ids)
+            val_tokens += len(val_ids)
+            written += len(chunk)
+
+    meta = {'tokenizer': tokenizer.state_dict(), 'dtype': np.dtype(dtype).name,
+            'train_tokens': train_tokens, 'val_tokens': val_tokens}
+    with open(os.path.join(out_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return meta
+
+def load_prepared(data_dir):
+    """ memory-map a directory written by prepare(); returns (train_data, val_data, tokenizer) """
+    with open(os.path.join(data_dir, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    train_data = np.memmap(os.path.join(data_dir, 'train.bin'), dtype=meta['dtype'], mode='r')
+    val_data = np.memmap(os.path.join(data_dir, 'val.bin'), dtype=meta['dtype'], mode='r')
+    # directories prepared before tokenizers were pluggable only list their characters
+    tokenizer = from_state(meta['tokenizer']) if 'tokenizer' in meta else CharTokenizer(meta['chars'])
+    return train_data, val_data, tokenizer
+
+def load_dataset(path, tokenizer=None, bpe_vocab_size=None):
+    """ (train_data, val_data, tokenizer) from a prepare()d directory, or by encoding a text file in memory
+
+    A text file is encoded with `tokenizer` if one is given; otherwise with a
+    byte-level BPE of bpe_vocab_size tokens learned from its train split, or,
+    by default, with the vocabulary of characters it contains.
+    """
+    if os.path.isdir(path):
+        return load_prepared(path)
+    text = load_text(path)
+    if tokenizer is None and bpe_vocab_size:
+        tokenizer = BPETokenizer.train(text[:int(0.9*len(text))], bpe_vocab_size)
+    elif tokenizer is None:
+        tokenizer = CharTokenizer.from_text(text)
+    data = torch.from_numpy(tokenizer.encode(text, np.uint8 if tokenizer.vocab_size <= 256 else np.int32))
+    train_data, val_data = split_data(data)
+    return train_data, val_data, tokenizer
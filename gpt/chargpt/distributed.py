@@ -0,0 +1,88 @@
+""" Data-parallel training across processes with torch.distributed, over gloo so it runs on plain CPU cores.
+
+Run from the gpt/ directory, e.g.:
+
+    python -m chargpt.distributed --nproc 4 --model gpt --grad-accum 2 --out gpt.pt
+    torchrun --nproc-per-node 4 -m chargpt.distributed --model gpt --out gpt.pt
+
+Every other flag is passed to chargpt.train. Each rank samples its batches from
+its own contiguous shard of the training data, and DistributedDataParallel
+averages gradients across ranks, so one optimizer step covers
+batch_size * grad_accum * nproc sequences. Only rank 0 evaluates, prints,
+writes checkpoints and samples.
+"""
+import argparse
+import os
+import socket
+
+import torch
+import torch.distributed as dist
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+def shard(data, rank, world_size):
+    """ the rank-th of world_size contiguous slices of a 1-d token array (a view, for tensors and memmaps alike) """
+    n = len(data) // world_size
+    return data[rank * n:(rank + 1) * n]
+
+def all_gather_object(obj):
+    """ [obj from rank 0, obj from rank 1, ...] on every rank; [obj] when not distributed """
+    if not is_distributed():
+        return [obj]
+    out = [None] * get_world_size()
+    dist.all_gather_object(out, obj)
+    return out
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _worker(rank, fn, nproc, port, threads, args):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    # split the cores between the ranks instead of every rank starting a thread per core
+    torch.set_num_threads(threads)
+    dist.init_process_group('gloo', rank=rank, world_size=nproc)
+    try:
+        fn(*args)
+    finally:
+        dist.destroy_process_group()
+
+def launch(fn, nproc, *args, threads=None):
+    """ run fn(*args) in nproc processes joined into a gloo process group; fn must be importable (picklable) """
+    threads = threads or max(1, (os.cpu_count() or 1) // nproc)
+    torch.multiprocessing.spawn(_worker, args=(fn, nproc, _free_port(), threads, args), nprocs=nproc)
+
+def _train_main(argv):
+    # imported here because chargpt.train uses the helpers above
+    from chargpt.train import main
+    # gloo all-reduces on the cpu; an explicit --device later in argv still wins
+    main(['--device', 'cpu'] + argv)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nproc', type=int, default=2, help='processes to start (ignored under torchrun)')
+    parser.add_argument('--threads', type=int, default=None, help='torch threads per process (default: cores / nproc)')
+    args, rest = parser.parse_known_args(argv)
+    if 'WORLD_SIZE' in os.environ:
+        # started by torchrun, which has set up the rendezvous environment
+        if args.threads:
+            torch.set_num_threads(args.threads)
+        dist.init_process_group('gloo')
+        try:
+            _train_main(rest)
+        finally:
+            dist.destroy_process_group()
+    else:
+        launch(_train_main, args.nproc, rest, threads=args.threads)
+
+if __name__ == '__main__':
+    main()
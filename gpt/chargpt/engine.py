@@ -0,0 +1,290 @@
+""" Batched, streaming text generation for GPTLanguageModel.
+
+Many prompts of different lengths decode together in one batch, so every
+decoding step is a single forward pass for all active requests. Each row of
+the batch fills its own kv cache window at its own positions, exactly as it
+would decoding alone: new requests are encoded on their own and then join the
+batch, and a row whose window is full is re-encoded from its latest tokens
+without touching the others. So a request's output doesn't depend on what
+else is in flight. Each request carries its own sampling settings, and newly
+decoded characters are streamed back as they are sampled:
+
+    engine = GenerationEngine(model, encode, decode, block_size)
+    for rid, text, done in engine.stream([Request("ROMEO:"), Request("JULIET:", top_k=10)]):
+        ...
+
+AsyncGenerationServer wraps an engine for asyncio code; requests submitted
+concurrently join the running batch.
+"""
+import asyncio
+import collections
+import itertools
+import threading
+from dataclasses import dataclass
+
+import torch
+
+from chargpt.attention import KVCache
+from chargpt.sampling import sample_next
+
+@dataclass
+class Request:
+    prompt: str
+    max_new_tokens: int = 500
+    temperature: float = 1.0 # 0 samples greedily
+    top_k: int = 0 # 0 disables top-k filtering
+    top_p: float = 1.0 # 1.0 disables nucleus filtering
+    stop: tuple = () # strings that end the request once generated (the stop string itself is included)
+
+class _Row:
+    """ one active request: its full token history and how much of it was generated """
+
+    def __init__(self, rid, request, tokens):
+        self.rid = rid
+        self.request = request
+        self.tokens = tokens
+        self.generated = 0
+        self.fill = 0 # cache slots in use, which are also the positions of the tokens in them
+        self.stop = tuple(s for s in request.stop if s) # an empty stop string would match at once
+        self.tail = '' # the last few generated characters, enough to spot any stop string
+
+class _BatchCache(KVCache):
+    """ one layer's keys and values for every row of the batch, where each row fills its own slots
+
+    A forward pass takes one new token for some of the rows (all of them if
+    rows is None), and writes each one's key and value to its own slot. The
+    caller masks every row's attention to the slots it has filled.
+    """
+
+    def __init__(self, cache):
+        self.k, self.v = cache.k, cache.v
+        self.pos = 0 # unused: positions are per row, and always passed to the model
+        self.rows = None
+        self.slots = None
+
+    def update(self, k, v):
+        rows = self.rows if self.rows is not None else torch.arange(self.k.size(0), device=self.k.device)
+        self.k[rows, :, self.slots] = k[:, :, 0]
+        self.v[rows, :, self.slots] = v[:, :, 0]
+        if self.rows is None:
+            return self.k, self.v
+        return self.k[rows], self.v[rows]
+
+class GenerationEngine:
+    """ continuous-batching generator over a GPTLanguageModel (see the module docstring) """
+
+    def __init__(self, model, encode, decode, block_size, max_batch_size=32, window_stride=None, generator=None):
+        self.model = model.eval()
+        self.encode = encode
+        self.decode = decode
+        self.block_size = block_size
+        self.max_batch_size = max_batch_size
+        # when the caches are full, rows are re-encoded from their last block_size - window_stride tokens
+        self.window_stride = block_size // 4 if window_stride is None else window_stride
+        assert 0 <= self.window_stride < block_size
+        self.generator = generator
+        self.device = next(model.parameters()).device
+        self.waiting = collections.deque()
+        self.rows = []
+        self.caches = None
+        self._ids = itertools.count()
+
+    def submit(self, request):
+        """ queue a request; returns the id its output is reported under """
+        rid = next(self._ids)
+        # an empty prompt starts from token 0, like the training script's sample
+        tokens = list(self.encode(request.prompt)) or [0]
+        self.waiting.append(_Row(rid, request, tokens))
+        return rid
+
+    def idle(self):
+        return not self.waiting and not self.rows
+
+    @torch.inference_mode()
+    def step(self):
+        """ sample one token for every active request; returns a list of (request id, text, finished) """
+        events, admitted = [], []
+        while self.waiting and len(self.rows) + len(admitted) < self.max_batch_size:
+            row = self.waiting.popleft()
+            if row.request.max_new_tokens <= 0:
+                events.append((row.rid, '', True))
+            else:
+                admitted.append(row)
+        if admitted:
+            self._admit(admitted)
+        if not self.rows:
+            return events
+
+        next_tokens = sample_next(self.logits, self.temperature, self.top_k, self.top_p, self.generator).tolist()
+        keep = []
+        for i, (row, tok) in enumerate(zip(self.rows, next_tokens)):
+            row.tokens.append(tok)
+            row.generated += 1
+            text = self.decode([tok])
+            done = row.generated >= row.request.max_new_tokens or self._stopped(row, text)
+            events.append((row.rid, text, done))
+            if not done:
+                keep.append(i)
+
+        if len(keep) < len(self.rows):
+            self._select(keep)
+        if self.rows:
+            self._advance()
+        return events
+
+    def stream(self, requests):
+        """ run requests to completion, yielding (index into requests, text, finished) as tokens are sampled """
+        index = {self.submit(r): i for i, r in enumerate(requests)}
+        while not self.idle():
+            for rid, text, done in self.step():
+                if rid in index:
+                    yield index[rid], text, done
+
+    def generate(self, requests):
+        """ run requests to completion and return the generated strings """
+        out = [[] for _ in requests]
+        for i, text, _ in self.stream(requests):
+            out[i].append(text)
+        return [''.join(chunks) for chunks in out]
+
+    def _stopped(self, row, text):
+        if not row.stop:
+            return False
+        row.tail = (row.tail + text)[-max(len(s) for s in row.stop):]
+        return any(row.tail.endswith(s) for s in row.stop)
+
+    def _encode(self, rows, keep):
+        # encode rows on their own from the last `keep` tokens of their histories, right-padded to a common
+        # length so that every row's tokens sit at positions (and cache slots) 0, 1, ...; padding comes after
+        # them, which the causal mask hides from them, and later tokens overwrite it in the cache
+        tails = [row.tokens[-keep:] for row in rows]
+        idx = torch.zeros((len(rows), max(len(t) for t in tails)), dtype=torch.long)
+        for i, t in enumerate(tails):
+            idx[i, :len(t)] = torch.tensor(t, dtype=torch.long)
+            rows[i].fill = len(t)
+        caches = self.model.make_caches(len(rows))
+        logits, _ = self.model(idx.to(self.device), caches=caches)
+        last = torch.tensor([len(t) - 1 for t in tails], device=self.device)
+        return caches, logits[torch.arange(len(rows), device=self.device), last]
+
+    def _admit(self, rows):
+        # encode newly admitted rows and add them to the batch; the rows already running are left alone
+        caches, logits = self._encode(rows, self.block_size)
+        settings = {
+            'temperature': torch.tensor([r.request.temperature for r in rows], dtype=torch.float, device=self.device),
+            'top_k': torch.tensor([r.request.top_k for r in rows], dtype=torch.long, device=self.device),
+            'top_p': torch.tensor([r.request.top_p for r in rows], dtype=torch.float, device=self.device),
+        }
+        if not self.rows:
+            self.caches = [_BatchCache(cache) for cache in caches]
+            self.logits = logits
+            for name, value in settings.items():
+                setattr(self, name, value)
+        else:
+            for batch, cache in zip(self.caches, caches):
+                batch.k, batch.v = torch.cat([batch.k, cache.k]), torch.cat([batch.v, cache.v])
+            self.logits = torch.cat([self.logits, logits])
+            for name, value in settings.items():
+                setattr(self, name, torch.cat([getattr(self, name), value]))
+        self.rows.extend(rows)
+
+    def _advance(self):
+        # feed each row's newest token to the model: into its next cache slot or, for rows whose window is
+        # full, by re-encoding it from its last block_size - window_stride tokens
+        full = [i for i, row in enumerate(self.rows) if row.fill == self.block_size]
+        rest = [i for i, row in enumerate(self.rows) if row.fill < self.block_size]
+        if rest:
+            rows = None if len(rest) == len(self.rows) else torch.tensor(rest, device=self.device)
+            slots = torch.tensor([self.rows[i].fill for i in rest], device=self.device)
+            for cache in self.caches:
+                cache.rows, cache.slots = rows, slots
+            idx = torch.tensor([[self.rows[i].tokens[-1]] for i in rest], dtype=torch.long, device=self.device)
+            width = self.caches[0].k.size(2)
+            mask = torch.arange(width, device=self.device) <= slots.unsqueeze(1) # (B, S): the filled slots and the new one
+            logits, _ = self.model(idx, caches=self.caches, pos=slots.unsqueeze(1), mask=mask[:, None, None, :])
+            if rows is None:
+                self.logits = logits[:, -1, :]
+            else:
+                self.logits[rows] = logits[:, -1, :]
+            for i in rest:
+                self.rows[i].fill += 1
+        if full:
+            caches, logits = self._encode([self.rows[i] for i in full], self.block_size - self.window_stride)
+            rows = torch.tensor(full, device=self.device)
+            for batch, cache in zip(self.caches, caches):
+                batch.k[rows], batch.v[rows] = cache.k, cache.v
+            self.logits[rows] = logits
+
+    def _select(self, keep):
+        # drop finished rows from the batch state
+        self.rows = [self.rows[i] for i in keep]
+        if not self.rows:
+            self.caches = None
+            return
+        keep = torch.tensor(keep, dtype=torch.long, device=self.device)
+        for cache in self.caches:
+            cache.k, cache.v = cache.k[keep], cache.v[keep]
+        for name in ('logits', 'temperature', 'top_k', 'top_p'):
+            setattr(self, name, getattr(self, name)[keep])
+
+class AsyncGenerationServer:
+    """ asyncio front end for a GenerationEngine
+
+    Concurrent callers each iterate their own stream, while a single worker
+    thread steps the shared engine, so one forward pass serves every request
+    that is in flight:
+
+        server = AsyncGenerationServer(engine)
+        async for text in server.generate(Request("ROMEO:")):
+            ...
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.queues = {}
+        self.lock = threading.Lock() # guards queues and the running flag
+        self.running = False
+
+    async def generate(self, request):
+        """ stream the decoded text of one request """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        with self.lock:
+            rid = self.engine.submit(request)
+            self.queues[rid] = (loop, queue)
+            if not self.running:
+                self.running = True
+                loop.run_in_executor(None, self._run)
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def _run(self):
+        # worker thread: step the engine until no work is left
+        while True:
+            with self.lock:
+                if self.engine.idle():
+                    self.running = False
+                    return
+            try:
+                events = self.engine.step()
+            except Exception as e:
+                with self.lock:
+                    for loop, queue in self.queues.values():
+                        loop.call_soon_threadsafe(queue.put_nowait, e)
+                    self.queues.clear()
+                    self.engine.rows.clear()
+                    self.engine.waiting.clear()
+                    self.running = False
+                return
+            with self.lock:
+                for rid, text, done in events:
+                    loop, queue = self.queues[rid]
+                    loop.call_soon_threadsafe(queue.put_nowait, text)
+                    if done:
+                        loop.call_soon_threadsafe(queue.put_nowait, None)
+                        del self.queues[rid]
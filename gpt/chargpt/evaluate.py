@@ -0,0 +1,113 @@
+""" Train/val loss estimates, in-process or from a separate process that follows a checkpoint.
+
+Run from the gpt/ directory, e.g.:
+
+    python -m chargpt.evaluate gpt.pt              # evaluate a checkpoint once
+    python -m chargpt.evaluate gpt.pt --watch      # re-evaluate whenever the checkpoint is rewritten
+
+chargpt.train --async-eval true starts the --watch mode itself, so training
+never stops to evaluate.
+"""
+import argparse
+import os
+import time
+
+import torch
+
+from chargpt.checkpoint import load_checkpoint, model_from_checkpoint
+from chargpt.data import load_dataset, get_windows, windows_at
+
+class Evaluator:
+    """ mean loss over a fixed set of eval_iters * batch_size windows per split
+
+    The windows are drawn once, from a private generator, and kept on the
+    device, so every evaluation scores the same text (estimates are comparable
+    across steps) and evaluation does not disturb the training RNG. They are
+    run eval_batch_size at a time under inference_mode, and losses are summed
+    on the device, with one host sync per split.
+    """
+
+    def __init__(self, splits, config, device):
+        generator = torch.Generator().manual_seed(config.seed)
+        n = config.eval_iters * config.batch_size
+        self.windows = {split: get_windows(data, config.block_size, n, generator).to(device)
+                        for split, data in splits.items()}
+        self.eval_batch_size = config.eval_batch_size
+
+    @torch.inference_mode()
+    def __call__(self, model):
+        out = {}
+        was_training = model.training
+        model.eval()
+        for split, windows in self.windows.items():
+            total = torch.zeros((), device=windows.device)
+            for chunk in windows.split(self.eval_batch_size):
+                chunk = chunk.long()
+                logits, loss = model(chunk[:, :-1], chunk[:, 1:].contiguous())
+                total += loss * len(chunk)
+            out[split] = (total / len(windows)).item()
+        model.train(was_training)
+        return out
+
+@torch.inference_mode()
+def split_loss(model, data, block_size, batch_size=64):
+    """ mean loss over (nearly) all of data, scored as consecutive non-overlapping windows of block_size targets """
+    was_training = model.training
+    model.eval()
+    starts = torch.arange(0, len(data) - block_size, block_size)
+    total = torch.zeros(())
+    for ix in starts.split(batch_size):
+        chunk = windows_at(data, ix, block_size).long()
+        logits, loss = model(chunk[:, :-1], chunk[:, 1:].contiguous())
+        total += loss * len(chunk)
+    model.train(was_training)
+    return (total / len(starts)).item()
+
+def evaluate_checkpoint(path, data_path, device='cpu', evaluator=None):
+    """ load a checkpoint and evaluate it; returns (iter, losses, evaluator) so the evaluator can be reused """
+    ckpt = load_checkpoint(path)
+    model, tokenizer = model_from_checkpoint(ckpt, device)
+    if evaluator is None:
+        train_data, val_data, data_tokenizer = load_dataset(data_path, tokenizer)
+        if data_tokenizer != tokenizer:
+            raise ValueError(f"{data_path} has a different vocabulary than {path}")
+        device = next(model.parameters()).device
+        evaluator = Evaluator({'train': train_data, 'val': val_data}, model.config, device)
+    return ckpt.get('iter'), evaluator(model), evaluator
+
+def watch(path, data_path, device='cpu', stop=None, poll=1.0, threads=None):
+    """ evaluate `path` each time it is rewritten, until `stop` (a multiprocessing Event) is set """
+    if threads:
+        torch.set_num_threads(threads)
+    evaluator, seen = None, None
+    while True:
+        # check stop before looking at the file, so the checkpoint written just before stop is still evaluated
+        stopping = stop is not None and stop.is_set()
+        mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+        if mtime is not None and mtime != seen:
+            seen = mtime
+            iter, losses, evaluator = evaluate_checkpoint(path, data_path, device, evaluator)
+            print(f"step {iter} (async eval): train loss {losses['train']:.4f}, val loss {losses['val']:.4f}", flush=True)
+        elif stopping:
+            return
+        else:
+            time.sleep(poll)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('checkpoint')
+    parser.add_argument('--data', default='input.txt', help='text file or chargpt.prepare directory')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--watch', action='store_true', help='keep evaluating each new checkpoint')
+    parser.add_argument('--threads', type=int, default=None, help='torch threads to use')
+    args = parser.parse_args(argv)
+    if args.watch:
+        watch(args.checkpoint, args.data, args.device, threads=args.threads)
+    else:
+        if args.threads:
+            torch.set_num_threads(args.threads)
+        iter, losses, _ = evaluate_checkpoint(args.checkpoint, args.data, args.device)
+        print(f"step {iter}: train loss {losses['train']:.4f}, val loss {losses['val']:.4f}")
+
+if __name__ == '__main__':
+    main()
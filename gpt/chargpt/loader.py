@@ -0,0 +1,68 @@
+import queue
+import threading
+
+import torch
+
+from chargpt.data import get_batch
+
+class PrefetchLoader:
+    """ training batches assembled `depth` steps ahead on a background thread
+
+    Batches are drawn from a private generator, so the sequence does not depend
+    on how far ahead the thread runs, and state_dict() captures exactly where the
+    consumer is for checkpointing. With a CUDA device, batches are staged in
+    pinned memory and copied with non_blocking transfers.
+    """
+
+    def __init__(self, data, block_size, batch_size, device, depth=2, seed=1337, state=None):
+        self.data = data
+        self.block_size = block_size
+        self.batch_size = batch_size
+        self.device = torch.device(device)
+        self.pin = self.device.type == 'cuda'
+        self.generator = torch.Generator()
+        if state is not None:
+            self.generator.set_state(state)
+        else:
+            self.generator.manual_seed(seed)
+        self.resume_state = self.generator.get_state() # reproduces the next batch handed out
+        self.queue = queue.Queue(maxsize=depth)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    def _produce(self):
+        try:
+            while not self.stopped.is_set():
+                x, y = get_batch(self.data, self.block_size, self.batch_size, 'cpu', self.generator)
+                if self.pin:
+                    x, y = x.pin_memory(), y.pin_memory()
+                self._put((x, y, self.generator.get_state()))
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        # block while the queue is full, but notice close()
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = self.queue.get()
+        if isinstance(item, Exception):
+            raise item
+        x, y, self.resume_state = item
+        return x.to(self.device, non_blocking=True), y.to(self.device, non_blocking=True)
+
+    def state_dict(self):
+        return self.resume_state
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
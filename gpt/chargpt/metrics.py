@@ -0,0 +1,152 @@
+import contextlib
+import csv
+import json
+import sys
+import time
+
+import torch
+
+from chargpt.config import synchronize
+
+PHASES = ('data', 'forward', 'backward', 'optimizer')
+FIELDS = ('step', 'loss', 'train_loss', 'val_loss') + tuple(f"{p}_ms" for p in PHASES) + \
+         ('step_ms', 'tokens_per_sec', 'tflops', 'mfu', 'params', 'peak_rss_mb')
+
+def peak_memory(device):
+    """ peak bytes held by this process: allocator high-water mark on cuda, max RSS otherwise """
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device)
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024 # bytes on macOS, KiB on Linux
+
+def flops_per_token(model):
+    """ training flops per token, forward and backward: 6 per parameter, plus attention over block_size (PaLM appendix B) """
+    n = sum(p.numel() for p in model.parameters())
+    c = model.config
+    attention = 12 * c.n_layer * c.n_embd * c.block_size if hasattr(c, 'n_layer') else 0
+    return 6 * n + attention
+
+class StepMetrics:
+    """ per-step timings of the data/forward/backward/optimizer phases, throughput and memory
+
+    Every step is timed; with a path ending in .jsonl or .csv, one record per
+    step is also appended to that file. Recording synchronizes the device at
+    the end of every phase, so the phases of asynchronous accelerator work are
+    attributed correctly. Without recording, steps never wait for the device;
+    report() waits once for the work they left queued, and counts that time
+    as optimizer time, so the window's totals stay right. MFU needs the device's peak flops, which are not
+    known for CPUs, so it is only reported when peak_tflops is given.
+    """
+
+    def __init__(self, model, tokens_per_step, device, path=None, peak_tflops=None):
+        self.device = device
+        self.params = sum(p.numel() for p in model.parameters())
+        self.step_flops = flops_per_token(model) * tokens_per_step
+        self.tokens_per_step = tokens_per_step
+        self.peak_flops = peak_tflops * 1e12 if peak_tflops else None
+        self.file = self.writer = None
+        if path is not None:
+            self.file = open(path, 'a', newline='')
+            if path.endswith('.csv'):
+                self.writer = csv.DictWriter(self.file, FIELDS)
+                if self.file.tell() == 0:
+                    self.writer.writeheader()
+        self.sync = self.file is not None
+        self.window = dict.fromkeys(PHASES, 0.0)
+        self.window_steps = 0
+        self.losses = {}
+
+    def begin(self):
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.t0 = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        # labelled in torch.profiler traces too
+        with torch.profiler.record_function(name):
+            t0 = time.perf_counter()
+            yield
+            if self.sync:
+                synchronize(self.device)
+            self.times[name] += time.perf_counter() - t0
+
+    def end(self, step, loss=None):
+        """ close the step; loss is the step's training loss (a tensor), read only when recording """
+        if self.sync:
+            synchronize(self.device)
+        elapsed = time.perf_counter() - self.t0
+        # without per-phase syncs, queued device work is only waited for here
+        self.times['optimizer'] += elapsed - sum(self.times.values())
+        for name, t in self.times.items():
+            self.window[name] += t
+        self.window_steps += 1
+        if self.file is None:
+            return
+        record = {
+            'step': step,
+            'loss': loss.item() if loss is not None else None,
+            'train_loss': self.losses.get('train'),
+            'val_loss': self.losses.get('val'),
+            **{f"{name}_ms": t * 1e3 for name, t in self.times.items()},
+            'step_ms': elapsed * 1e3,
+            'tokens_per_sec': self.tokens_per_step / elapsed,
+            'tflops': self.step_flops / elapsed / 1e12,
+            'mfu': self.step_flops / elapsed / self.peak_flops if self.peak_flops else None,
+            'params': self.params,
+            'peak_rss_mb': peak_memory(self.device) / 2**20,
+        }
+        self.losses = {}
+        if self.writer is not None:
+            self.writer.writerow(record)
+        else:
+            self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def record_losses(self, losses):
+        """ attach estimated train/val losses to the next step's record """
+        self.losses = losses
+
+    def report(self):
+        """ mean phase times since the last report, as text; empty if no steps ran """
+        if not self.window_steps:
+            return ''
+        t0 = time.perf_counter()
+        synchronize(self.device)
+        self.window['optimizer'] += time.perf_counter() - t0
+        n = self.window_steps
+        ms = {name: t / n * 1e3 for name, t in self.window.items()}
+        self.window = dict.fromkeys(PHASES, 0.0)
+        self.window_steps = 0
+        return (f"data {ms['data']:.1f} ms/step, compute {ms['forward'] + ms['backward'] + ms['optimizer']:.1f} ms/step "
+                f"(forward {ms['forward']:.1f}, backward {ms['backward']:.1f}, optimizer {ms['optimizer']:.1f})")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+class StepProfiler:
+    """ a torch.profiler trace of steps [start, stop), exported as a Chrome trace to `out` """
+
+    def __init__(self, start, stop, out, device):
+        self.start, self.stop, self.out = start, stop, out
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if device.type == 'cuda':
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.profiler = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+        self.active = False
+
+    def step(self, iter):
+        """ call before running step `iter` """
+        if iter == self.start and not self.active:
+            self.profiler.__enter__()
+            self.active = True
+        elif iter == self.stop and self.active:
+            self.close()
+
+    def close(self):
+        if self.active:
+            self.profiler.__exit__(None, None, None)
+            self.profiler.export_chrome_trace(self.out)
+            self.active = False
+            print(f"wrote profiler trace of steps {self.start}-{self.stop - 1} to {self.out}")
@@ -0,0 +1,235 @@
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.nn import functional as F
+
+from chargpt import sampling
+from chargpt.attention import MultiHeadAttention, CausalSelfAttention, KVCache
+
+class FeedFoward(nn.Module):
+    """ a simple linear layer followed by a non-linearity """
+
+    def __init__(self, n_embd, dropout):
+        super().__init__()
+        self.net = nn.Sequential(
+            nn.Linear(n_embd, 4 * n_embd),
+            nn.ReLU(),
+            nn.Linear(4 * n_embd, n_embd),
+            nn.Dropout(dropout),
+        )
+
+    def forward(self, x):
+        return self.net(x)
+
+class Block(nn.Module):
+    """ Transformer block: communication followed by computation """
+
+    def __init__(self, config):
+        super().__init__()
+        n_embd, n_head = config.n_embd, config.n_head
+        head_size = n_embd // n_head
+        if config.fused_attention:
+            self.sa = CausalSelfAttention(n_embd, n_head, config.block_size, config.dropout, use_sdpa=config.use_sdpa)
+        else:
+            self.sa = MultiHeadAttention(n_embd, n_head, head_size, config.block_size, config.dropout)
+        self.ffwd = FeedFoward(n_embd, config.dropout)
+        self.ln1 = nn.LayerNorm(n_embd)
+        self.ln2 = nn.LayerNorm(n_embd)
+
+    def forward(self, x, cache=None, mask=None):
+        x = x + self.sa(self.ln1(x), cache, mask)
+        x = x + self.ffwd(self.ln2(x))
+        return x
+
+class GPTLanguageModel(nn.Module):
+
+    def __init__(self, config, vocab_size):
+        super().__init__()
+        self.config = config
+        # each token directly reads off the logits for the next token from a lookup table
+        self.token_embedding_table = nn.Embedding(vocab_size, config.n_embd)
+        self.position_embedding_table = nn.Embedding(config.block_size, config.n_embd)
+        self.blocks = nn.Sequential(*[Block(config) for _ in range(config.n_layer)])
+        self.ln_f = nn.LayerNorm(config.n_embd) # final layer norm
+        self.lm_head = nn.Linear(config.n_embd, vocab_size)
+
+        # better init, not covered in the original GPT video, but important, will cover in followup video
+        self.apply(self._init_weights)
+
+    def _init_weights(self, module):
+        if isinstance(module, nn.Linear):
+            torch.nn.init.normal_(module.weight, mean=0.0, std=0.02)
+            if module.bias is not None:
+                torch.nn.init.zeros_(module.bias)
+        elif isinstance(module, nn.Embedding):
+            torch.nn.init.normal_(module.weight, mean=0.0, std=0.02)
+
+    def forward(self, idx, targets=None, caches=None, pos=None, mask=None):
+        B, T = idx.shape
+        # with kv caches (one per block), idx only holds the tokens that follow the cached ones.
+        # pos optionally gives per-row (B,T) positions and mask an attention mask (see CausalSelfAttention),
+        # for batches of left-padded prompts
+        if pos is None:
+            start = caches[0].pos if caches is not None else 0
+            pos = torch.arange(start, start + T, device=idx.device)
+
+        # idx and targets are both (B,T) tensor of integers
+        tok_emb = self.token_embedding_table(idx) # (B,T,C)
+        pos_emb = self.position_embedding_table(pos) # (T,C) or (B,T,C)
+        x = tok_emb + pos_emb # (B,T,C)
+        if caches is None and mask is None:
+            x = self.blocks(x) # (B,T,C)
+        else:
+            for i, block in enumerate(self.blocks):
+                x = block(x, caches[i] if caches is not None else None, mask) # (B,T,C)
+        x = self.ln_f(x) # (B,T,C)
+        logits = self.lm_head(x) # (B,T,vocab_size)
+
+        if targets is None:
+            loss = None
+        else:
+            B, T, C = logits.shape
+            logits = logits.view(B*T, C)
+            targets = targets.view(B*T)
+            loss = F.cross_entropy(logits, targets)
+
+        return logits, loss
+
+    def make_caches(self, batch_size):
+        # one kv cache per block, each able to hold a full block_size window
+        c = self.config
+        w = self.ln_f.weight # lm_head's weight is packed int8 in a quantized model
+        return [KVCache(batch_size, c.n_head, c.block_size, c.n_embd // c.n_head, device=w.device, dtype=w.dtype)
+                for _ in range(c.n_layer)]
+
+    def generate(self, idx, max_new_tokens, use_cache=None, window_stride=None, sampler=None, stop=None):
+        # idx is (B, T) array of indices in the current context; see chargpt.sampling for sampler and stop
+        return sampling.generate(self, idx, max_new_tokens, sampler, stop, use_cache=use_cache, window_stride=window_stride)
+
+    def start_decoding(self, batch_size, use_cache=None, window_stride=None):
+        # with use_cache, each step only runs the newest token through the model. Once the cache holds
+        # block_size steps, it is refilled from the last block_size - window_stride tokens, so positions
+        # stay within the window and the re-encode is paid once every window_stride tokens. Up to
+        # block_size tokens the output is identical to the uncached sampler; window_stride=0 keeps it
+        # identical beyond that too, at the cost of re-encoding the full window every step.
+        if use_cache is None:
+            use_cache = self.config.fused_attention
+        if window_stride is None:
+            window_stride = self.config.block_size // 4
+        assert 0 <= window_stride < self.config.block_size
+        return {'caches': self.make_caches(batch_size) if use_cache else None, 'window_stride': window_stride}
+
+    def next_logits(self, idx, state):
+        # (B, V) logits for the token after the (B, T) context idx
+        block_size = self.config.block_size
+        caches = state['caches']
+        if caches is None:
+            # crop idx to the last block_size tokens
+            idx_cond = idx[:, -block_size:]
+        elif caches[0].pos == 0 or caches[0].pos == block_size:
+            # (re)fill the caches from the tail of the context
+            keep = block_size if caches[0].pos == 0 else block_size - state['window_stride']
+            for cache in caches:
+                cache.reset()
+            idx_cond = idx[:, -keep:]
+        else:
+            # only the token sampled last step is new
+            idx_cond = idx[:, -1:]
+        logits, loss = self(idx_cond, caches=caches)
+        # focus only on the last time step
+        return logits[:, -1, :] # becomes (B, C)
+
+    def reorder_decoding(self, state, index):
+        # beam search moved the sequences around; move their cached keys and values with them
+        for cache in state['caches'] or ():
+            cache.k.copy_(cache.k[index])
+            cache.v.copy_(cache.v[index])
+
+# super simple bigram model
+def bigram_counts(data, vocab_size, chunk_size=1 << 24):
+    """ (V, V) int64 counts of each (token, next token) pair in data, counted chunk by chunk so memmapped data is read once """
+    counts = np.zeros(vocab_size * vocab_size, dtype=np.int64)
+    for i in range(0, max(len(data) - 1, 0), chunk_size):
+        # chunks overlap by one token, so the pair that straddles each boundary is counted once
+        chunk = np.asarray(data[i:i + chunk_size + 1]).astype(np.int64)
+        counts += np.bincount(chunk[:-1] * vocab_size + chunk[1:], minlength=vocab_size * vocab_size)
+    return counts.reshape(vocab_size, vocab_size)
+
+class BigramLanguageModel(nn.Module):
+
+    def __init__(self, config, vocab_size):
+        super().__init__()
+        self.config = config
+        # each token directly reads off the logits for the next token from a lookup table
+        self.token_embedding_table = nn.Embedding(vocab_size, vocab_size)
+
+    def forward(self, idx, targets=None):
+
+        # idx and targets are both (B,T) tensor of integers
+        logits = self.token_embedding_table(idx) # (B,T,C)
+
+        if targets is None:
+            loss = None
+        else:
+            B, T, C = logits.shape
+            logits = logits.view(B*T, C)
+            targets = targets.view(B*T)
+            loss = F.cross_entropy(logits, targets)
+
+        return logits, loss
+
+    def generate(self, idx, max_new_tokens, sampler=None, stop=None):
+        # idx is (B, T) array of indices in the current context; see chargpt.sampling for sampler and stop
+        return sampling.generate(self, idx, max_new_tokens, sampler, stop)
+
+    def start_decoding(self, batch_size):
+        return None
+
+    def next_logits(self, idx, state):
+        # the next token's logits depend only on the current one
+        return self.token_embedding_table(idx[:, -1])
+
+    def reorder_decoding(self, state, index):
+        pass
+
+    @torch.no_grad()
+    def fit_counts(self, data, smoothing=1.0):
+        """ set the table, in closed form, to the maximum likelihood bigram model of data with add-`smoothing` counts
+
+        The row of logits for token a becomes log P(b | a) = log((count(a, b) + smoothing) / (count(a) + V * smoothing)),
+        which is the minimum of the training loss that SGD approaches. A token that is never
+        followed by anything predicts the uniform distribution; with smoothing=0, pairs that
+        never occur get a logit of -inf.
+        """
+        weight = self.token_embedding_table.weight
+        counts = torch.from_numpy(bigram_counts(data, weight.size(0))).double() + smoothing
+        totals = counts.sum(dim=1, keepdim=True)
+        logp = torch.where(totals > 0, counts.log() - totals.log(), 0.0)
+        weight.copy_(logp)
+        return self
+
+    @torch.inference_mode()
+    def generate_table(self, idx, max_new_tokens, generator=None):
+        """ sample like generate() at temperature 1, as pure table lookups: no autograd, softmax or module calls per token
+
+        Each row of the table is turned into a cumulative distribution once, all the
+        uniform draws are made up front, and each step is a gather plus a
+        searchsorted over the batch.
+        """
+        B, T = idx.shape
+        cdf = F.softmax(self.token_embedding_table.weight.float(), dim=-1).cumsum(dim=-1)
+        cdf[:, -1] = 1.0 # rounding must not leave a draw above the last bucket
+        u = torch.rand((max_new_tokens, B, 1), generator=generator, device=idx.device)
+        out = torch.empty((B, T + max_new_tokens), dtype=torch.long, device=idx.device)
+        out[:, :T] = idx
+        token = idx[:, -1]
+        for t in range(max_new_tokens):
+            token = torch.searchsorted(cdf[token], u[t], right=True).squeeze(1)
+            out[:, T + t] = token
+        return out
+
+MODELS = {'gpt': GPTLanguageModel, 'bigram': BigramLanguageModel}
+
+def build_model(model_type, config, vocab_size):
+    """ instantiate the model named by model_type ('gpt' or 'bigram') """
+    return MODELS[model_type](config, vocab_size)
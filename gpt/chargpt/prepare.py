@@ -0,0 +1,30 @@
+""" Tokenize a text file once, into memory-mappable train/val token files for chargpt.train.
+
+Run from the gpt/ directory, e.g.:
+
+    python -m chargpt.prepare input.txt data/shakespeare
+    python -m chargpt.prepare input.txt data/shakespeare-bpe --bpe-vocab-size 512
+    python -m chargpt.train --data data/shakespeare
+
+The text is streamed in chunks, so corpora larger than memory can be prepared.
+"""
+import argparse
+
+from chargpt.data import prepare
+from chargpt.tokenizer import from_state
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('text', help='utf-8 text file')
+    parser.add_argument('out_dir', help='directory for train.bin, val.bin and meta.json')
+    parser.add_argument('--train-frac', type=float, default=0.9)
+    parser.add_argument('--bpe-vocab-size', type=int, default=None,
+                        help='learn a byte-level BPE of this many tokens instead of using the characters of the text')
+    args = parser.parse_args(argv)
+    meta = prepare(args.text, args.out_dir, args.train_frac, bpe_vocab_size=args.bpe_vocab_size)
+    tokenizer = from_state(meta['tokenizer'])
+    print(f"{tokenizer.vocab_size} {meta['tokenizer']['kind']} tokens ({meta['dtype']}), "
+          f"{meta['train_tokens']} train / {meta['val_tokens']} val tokens")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+""" Export a trained checkpoint as an int8 model for CPU inference.
+
+Run from the gpt/ directory, e.g.:
+
+    python -m chargpt.quantize gpt.pt gpt-int8.pt
+    python -m chargpt.sample gpt-int8.pt --prompt "ROMEO:"
+
+Every nn.Linear (the attention projections, FeedFoward.net and lm_head) is
+replaced by a dynamically quantized int8 linear layer, and dropout is folded
+away. The artifact holds the config and tokenizer along with the quantized
+weights, so chargpt.checkpoint.load_model reads it like any checkpoint. The
+export reports perplexity on the val split (the held-out last 10% of --data)
+for the float32 and int8 models; see `python -m chargpt.bench quantize` for
+speed.
+"""
+import argparse
+import math
+import os
+import warnings
+from dataclasses import asdict
+
+import torch
+import torch.nn as nn
+
+from chargpt.checkpoint import load_checkpoint, load_model
+from chargpt.data import load_dataset
+from chargpt.evaluate import split_loss
+
+def fold_dropout(model):
+    """ replace every dropout with the identity it is at inference time """
+    for name, module in model.named_children():
+        if isinstance(module, nn.Dropout):
+            setattr(model, name, nn.Identity())
+        else:
+            fold_dropout(module)
+    if hasattr(model, 'dropout_p'):
+        model.dropout_p = 0.0 # CausalSelfAttention passes this to scaled_dot_product_attention
+    return model
+
+def quantize(model):
+    """ convert model, in place, for inference: dropout folded away and every nn.Linear dynamically quantized to int8 """
+    from torch.ao.quantization import quantize_dynamic
+    model = fold_dropout(model.eval())
+    model.config.dropout = 0.0
+    with warnings.catch_warnings():
+        # eager-mode quantization is deprecated in favour of the separate torchao package, which we don't depend on
+        warnings.simplefilter('ignore')
+        return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+def export(path, out):
+    """ quantize the checkpoint at path and save it to out; returns the quantized model """
+    ckpt = load_checkpoint(path)
+    model, tokenizer = load_model(path, 'cpu')
+    model = quantize(model)
+    artifact = {
+        'model_type': ckpt['model_type'],
+        'config': asdict(model.config),
+        'tokenizer': tokenizer.state_dict(),
+        'model': model.state_dict(),
+        'quantized': 'dynamic-int8',
+    }
+    tmp = f"{out}.tmp"
+    torch.save(artifact, tmp)
+    os.replace(tmp, out)
+    return model
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('checkpoint', help='checkpoint written by chargpt.train --out')
+    parser.add_argument('out', help='int8 model file to write')
+    parser.add_argument('--data', default='input.txt', help='text file or chargpt.prepare directory for the parity report')
+    parser.add_argument('--no-check', action='store_true', help='skip the perplexity comparison')
+    parser.add_argument('--batch-size', type=int, default=64, help='windows per forward pass while scoring')
+    args = parser.parse_args(argv)
+
+    qmodel = export(args.checkpoint, args.out)
+    print(f"wrote {args.out}: {os.path.getsize(args.out) / 2**20:.1f} MiB "
+          f"(float32 checkpoint {os.path.getsize(args.checkpoint) / 2**20:.1f} MiB, including optimizer state)")
+    if args.no_check:
+        return
+    model, tokenizer = load_model(args.checkpoint, 'cpu')
+    _, val_data, data_tokenizer = load_dataset(args.data, tokenizer)
+    if data_tokenizer != tokenizer:
+        raise ValueError(f"{args.data} has a different vocabulary than {args.checkpoint}")
+    block_size = model.config.block_size
+    losses = {name: split_loss(m, val_data, block_size, args.batch_size) for name, m in (('float32', model), ('int8', qmodel))}
+    for name, loss in losses.items():
+        print(f"{name:>8}: val loss {loss:.4f}, perplexity {math.exp(loss):.4f}")
+    print(f"int8 perplexity is {(math.exp(losses['int8'] - losses['float32']) - 1) * 100:+.2f}% relative to float32")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+""" Sample text from a checkpoint saved by chargpt.train.
+
+Run from the gpt/ directory, e.g.:
+
+    python -m chargpt.sample gpt.pt --prompt "ROMEO:" --prompt "JULIET:" --top-k 20
+
+A single prompt is streamed to stdout as it is generated; several prompts are
+generated together in one batch and printed in order. --beams N returns the
+most likely continuation found by a beam search instead of sampling, and
+--stop ends a prompt's output at the first occurrence of the given string.
+"""
+import argparse
+import sys
+
+import torch
+
+from chargpt.checkpoint import load_model
+from chargpt.engine import GenerationEngine, Request
+from chargpt.model import GPTLanguageModel
+from chargpt.sampling import Sampler, beam_search
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('weights', help='checkpoint written by chargpt.train --out')
+    parser.add_argument('--prompt', action='append', help='may be given several times (default: a single empty prompt)')
+    parser.add_argument('--max-new-tokens', type=int, default=500)
+    parser.add_argument('--temperature', type=float, default=1.0)
+    parser.add_argument('--top-k', type=int, default=0)
+    parser.add_argument('--top-p', type=float, default=1.0)
+    parser.add_argument('--beams', type=int, default=0, help='beam search with this many beams instead of sampling')
+    parser.add_argument('--stop', action='append', default=[], help='stop a prompt once this string is generated; may be repeated')
+    parser.add_argument('--seed', type=int, default=1337)
+    parser.add_argument('--device', default='auto')
+    args = parser.parse_args(argv)
+
+    torch.manual_seed(args.seed)
+    model, tokenizer = load_model(args.weights, args.device)
+    prompts = args.prompt or ['']
+
+    if args.beams or not isinstance(model, GPTLanguageModel):
+        device = next(model.parameters()).device
+        stop = [tokenizer.encode(s).tolist() for s in args.stop]
+        for prompt in prompts:
+            context = torch.tensor([tokenizer.encode(prompt).tolist() or [0]], dtype=torch.long, device=device)
+            if args.beams:
+                out = beam_search(model, context, args.max_new_tokens, args.beams, stop=stop)
+            elif Sampler(args.temperature, args.top_k, args.top_p) == Sampler() and not stop and hasattr(model, 'generate_table'):
+                # plain sampling from the bigram table needs no per-step model calls
+                out = model.generate_table(context, args.max_new_tokens)
+            else:
+                sampler = Sampler(args.temperature, args.top_k, args.top_p)
+                out = model.generate(context, args.max_new_tokens, sampler=sampler, stop=stop)
+            tokens, length = (out[0][0], out[1][0]) if stop else (out[0], out.size(1))
+            print(prompt + tokenizer.decode(tokens[context.size(1):length].tolist()))
+        return
+
+    engine = GenerationEngine(model, tokenizer.encode, tokenizer.decode, model.config.block_size)
+    requests = [Request(p, args.max_new_tokens, args.temperature, args.top_k, args.top_p, tuple(args.stop)) for p in prompts]
+    if len(requests) == 1:
+        sys.stdout.write(prompts[0])
+        for _, text, _ in engine.stream(requests):
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        sys.stdout.write('\n')
+    else:
+        for prompt, text in zip(prompts, engine.generate(requests)):
+            print(prompt + text)
+            print('-' * 40)
+
+if __name__ == '__main__':
+    main()
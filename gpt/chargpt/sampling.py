@@ -0,0 +1,178 @@
+""" Decoding for GPTLanguageModel and BigramLanguageModel: samplers, greedy and beam search.
+
+A model plugs in through three methods: start_decoding(batch_size, **options)
+returns its per-sequence state (kv caches, say), next_logits(tokens, state)
+returns the (B, V) logits that follow a (B, T) prefix, and
+reorder_decoding(state, index) reorders that state when beam search reshuffles
+its beams. Tokens are written into a buffer preallocated for the whole
+output, and samplers filter each step's logits in place.
+
+A logits processor is any callable processor(logits, tokens) that edits the
+(B, V) logits in place, given the (B, T) tokens so far; samplers and beam
+search run their processors before anything else each step.
+"""
+from dataclasses import dataclass, field
+
+import torch
+from torch.nn import functional as F
+
+def top_k_(logits, k):
+    """ keep the k largest logits of each row, in place """
+    if 0 < k < logits.size(-1):
+        kth = logits.topk(k, dim=-1).values[:, -1:]
+        logits.masked_fill_(logits < kth, float('-inf'))
+    return logits
+
+def top_p_(logits, p):
+    """ keep the smallest set of most likely tokens whose probability reaches p, in place """
+    if p < 1.0:
+        sorted_logits, sorted_idx = logits.sort(dim=-1, descending=True)
+        probs = F.softmax(sorted_logits, dim=-1)
+        # drop tokens once the more likely ones already cover p (the first token is always kept)
+        remove = (probs.cumsum(dim=-1) - probs) > p
+        logits.masked_fill_(remove.scatter(1, sorted_idx, remove), float('-inf'))
+    return logits
+
+def repetition_penalty(penalty):
+    """ a logits processor that makes every token already in the sequence less likely (CTRL-style) """
+    def processor(logits, tokens):
+        scores = logits.gather(1, tokens)
+        logits.scatter_(1, tokens, torch.where(scores < 0, scores * penalty, scores / penalty))
+    return processor
+
+@dataclass
+class Sampler:
+    """ next-token choice with the same settings for every row
+
+    Processors run first, then temperature, top-k and top-p filter the logits
+    in place, and the token is drawn from the softmax of what is left.
+    temperature=0 picks the most likely token (greedy decoding).
+    """
+    temperature: float = 1.0
+    top_k: int = 0 # 0 disables top-k filtering
+    top_p: float = 1.0 # 1.0 disables nucleus filtering
+    processors: list = field(default_factory=list)
+    generator: torch.Generator = None
+
+    def __call__(self, logits, tokens):
+        for processor in self.processors:
+            processor(logits, tokens)
+        if self.temperature == 0:
+            return logits.argmax(dim=-1)
+        if self.temperature != 1.0:
+            logits.div_(self.temperature)
+        top_p_(top_k_(logits, self.top_k), self.top_p)
+        probs = F.softmax(logits, dim=-1) # (B, V)
+        return torch.multinomial(probs, num_samples=1, generator=self.generator).squeeze(1) # (B,)
+
+def greedy():
+    return Sampler(temperature=0)
+
+def sample_next(logits, temperature, top_k, top_p, generator=None):
+    """ sample one token per row of (B, V) logits, with per-row (B,) temperature, top_k and top_p; filters logits in place """
+    V = logits.size(-1)
+    logits.div_(temperature.clamp(min=1e-5).unsqueeze(1))
+    sorted_logits, sorted_idx = logits.sort(dim=-1, descending=True)
+    ranks = torch.arange(V, device=logits.device).unsqueeze(0)
+    remove = (top_k.unsqueeze(1) > 0) & (ranks >= top_k.unsqueeze(1))
+    probs = F.softmax(sorted_logits.masked_fill_(remove, float('-inf')), dim=-1)
+    # drop tokens once the more likely ones already cover top_p (the first token is always kept)
+    remove |= (probs.cumsum(dim=-1) - probs) > top_p.unsqueeze(1)
+    probs = F.softmax(sorted_logits.masked_fill_(remove, float('-inf')), dim=-1)
+    choice = torch.multinomial(probs, num_samples=1, generator=generator) # (B, 1)
+    choice = torch.where(temperature.unsqueeze(1) == 0, torch.zeros_like(choice), choice)
+    return sorted_idx.gather(1, choice).squeeze(1) # (B,)
+
+def _stop_hits(out, t, stop):
+    """ (B,) bool: rows of out[:, :t] that end in one of the stop sequences """
+    hit = torch.zeros(out.size(0), dtype=torch.bool, device=out.device)
+    for seq in stop:
+        if len(seq) <= t:
+            hit |= (out[:, t-len(seq):t] == seq).all(dim=1)
+    return hit
+
+def _stop_tensors(stop, device):
+    return [torch.as_tensor(list(seq), dtype=torch.long, device=device) for seq in stop or () if len(seq)]
+
+@torch.no_grad()
+def generate(model, idx, max_new_tokens, sampler=None, stop=None, **options):
+    """ extend each row of the (B, T) prompts idx by max_new_tokens tokens
+
+    Returns the (B, T + max_new_tokens) tokens. With stop, a list of token id
+    sequences, a row is finished once it ends in one of them, generation ends
+    early when every row is finished, and (tokens, lengths) is returned, where
+    lengths[i] counts row i's tokens up to the end of its stop sequence.
+    options go to model.start_decoding.
+    """
+    sampler = sampler or Sampler()
+    stop = _stop_tensors(stop, idx.device)
+    B, T = idx.shape
+    out = torch.empty((B, T + max_new_tokens), dtype=torch.long, device=idx.device)
+    out[:, :T] = idx
+    lengths = torch.full((B,), T + max_new_tokens, dtype=torch.long, device=idx.device)
+    finished = torch.zeros(B, dtype=torch.bool, device=idx.device)
+    state = model.start_decoding(B, **options)
+    t = T
+    for _ in range(max_new_tokens):
+        logits = model.next_logits(out[:, :t], state)
+        out[:, t] = sampler(logits, out[:, :t])
+        t += 1
+        if stop:
+            hit = _stop_hits(out, t, stop) & ~finished
+            lengths[hit] = t
+            finished |= hit
+            if finished.all():
+                break
+    if not stop:
+        return out[:, :t]
+    return out[:, :t], lengths.clamp(max=t)
+
+@torch.no_grad()
+def beam_search(model, idx, max_new_tokens, num_beams=4, length_penalty=1.0, stop=None, processors=(), **options):
+    """ the most likely continuation of each row of idx found by a beam search of num_beams beams
+
+    Beams are ranked by total log-probability divided by generated
+    length ** length_penalty. With stop sequences, a beam that ends in one is
+    finished and keeps its score, and (tokens, lengths) is returned as in
+    generate().
+    """
+    stop_seqs = _stop_tensors(stop, idx.device)
+    B, T = idx.shape
+    K = num_beams
+    out = torch.empty((B * K, T + max_new_tokens), dtype=torch.long, device=idx.device)
+    out[:, :T] = idx.repeat_interleave(K, dim=0)
+    scores = torch.zeros((B, K), device=idx.device)
+    scores[:, 1:] = float('-inf') # the beams start out identical; expand only the first
+    lengths = torch.full((B * K,), T + max_new_tokens, dtype=torch.long, device=idx.device)
+    finished = torch.zeros(B * K, dtype=torch.bool, device=idx.device)
+    base = torch.arange(B, device=idx.device).unsqueeze(1) * K
+    state = model.start_decoding(B * K, **options)
+    t = T
+    for _ in range(max_new_tokens):
+        logits = model.next_logits(out[:, :t], state)
+        for processor in processors:
+            processor(logits, out[:, :t])
+        logp = F.log_softmax(logits.float(), dim=-1) # (B*K, V)
+        V = logp.size(-1)
+        # a finished beam continues with token 0 at no cost, so its score is carried along unchanged
+        logp[finished] = float('-inf')
+        logp[finished, 0] = 0.0
+        scores, flat = (scores.view(-1, 1) + logp).view(B, K * V).topk(K, dim=1)
+        origin = (flat // V + base).view(-1)
+        out[:, :t] = out[origin, :t]
+        out[:, t] = (flat % V).view(-1)
+        lengths, finished = lengths[origin], finished[origin]
+        model.reorder_decoding(state, origin)
+        t += 1
+        if stop_seqs:
+            hit = _stop_hits(out, t, stop_seqs) & ~finished
+            lengths[hit] = t
+            finished |= hit
+            if finished.all():
+                break
+    lengths = lengths.clamp(max=t)
+    generated = (lengths - T).clamp(min=1).float().view(B, K)
+    best = (scores / generated ** length_penalty).argmax(dim=1) + base.squeeze(1)
+    if not stop_seqs:
+        return out[best, :t]
+    return out[best, :t], lengths[best]
@@ -0,0 +1,137 @@
+""" Score a long text with a trained model: per-token log-probs and perplexity, streamed through overlapping windows.
+
+Run from the gpt/ directory, e.g.:
+
+    python -m chargpt.score gpt.pt more.txt
+    python -m chargpt.score gpt.pt corpus.txt --stride 64 --logprobs corpus.f32
+
+The model only sees block_size tokens at a time, so the text is cut into
+windows of block_size tokens that start every --stride tokens. Each token is
+scored exactly once, by the window that gives it the most context: the first
+window scores all its tokens and every later one only its last `stride`, so
+all but the first block_size tokens are predicted from at least
+block_size - stride tokens of context. A smaller stride gives a better (lower)
+perplexity at block_size / stride times the cost; stride = block_size scores
+non-overlapping windows, like chargpt.evaluate.split_loss.
+
+The file is read and tokenized in chunks, and only one batch of windows and
+the unscored tail of the text are held at a time, so memory use does not grow
+with the length of the text. --logprobs writes each token's natural log-prob
+as raw float32 (the first token, which nothing predicts, is skipped).
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+import torch
+from torch.nn import functional as F
+
+from chargpt.checkpoint import load_model
+from chargpt.data import _read_chunks, windows_at
+
+def _target_logprobs(model, windows):
+    """ (B, L) log-probs of windows[:, 1:] given the tokens before them, for (B, L + 1) windows """
+    logits, _ = model(windows[:, :-1])
+    return F.log_softmax(logits.float(), dim=-1).gather(-1, windows[:, 1:].unsqueeze(-1)).squeeze(-1)
+
+def score_tokens(model, chunks, stride=None, batch_size=64):
+    """ the log-prob of every token of a stream after its first, yielded as float32 arrays in stream order
+
+    chunks is an iterable of 1-D arrays of token ids, which are concatenated;
+    it is read lazily, one chunk ahead of the windows being scored. stride
+    defaults to half of block_size.
+    """
+    T = model.config.block_size
+    stride = stride or max(T // 2, 1)
+    assert 0 < stride <= T, 'stride must be between 1 and block_size'
+    device = next(model.parameters()).device
+    was_training = model.training
+    model.eval()
+    try:
+        buf = np.zeros(0, dtype=np.int64) # tokens base, base + 1, ... of the stream
+        base = 0
+        start = 0 # first token of the next window
+        scored = 0 # tokens 1..scored have been scored
+        pending = [] # starts of the windows waiting for a full batch
+
+        def flush():
+            nonlocal scored
+            windows = windows_at(buf, torch.as_tensor(pending) - base, T).to(device).long()
+            with torch.inference_mode():
+                logp = _target_logprobs(model, windows)
+            # each window scores the tokens after the last one already scored, up to its end
+            keep = []
+            for s in pending:
+                keep.append(s + T - max(scored, s))
+                scored = s + T
+            pending.clear()
+            return torch.cat([row[T - k:] for row, k in zip(logp, keep)]).cpu().numpy()
+
+        for chunk in chunks:
+            buf = np.concatenate([buf, np.asarray(chunk, dtype=np.int64)])
+            while start + T < base + len(buf):
+                pending.append(start)
+                start += stride
+                if len(pending) == batch_size:
+                    yield flush()
+            # later windows, and the final partial one, start no earlier than the last full window
+            keep_from = pending[0] if pending else max(start - stride, 0)
+            buf, base = buf[keep_from - base:], keep_from
+        if pending:
+            yield flush()
+
+        # the tokens after the last full window: one shorter batch-of-one window ending at the last token
+        end = base + len(buf) - 1
+        if end > scored:
+            s = max(end - T, 0)
+            window = torch.from_numpy(buf[s - base:end - base + 1]).to(device).unsqueeze(0)
+            with torch.inference_mode():
+                logp = _target_logprobs(model, window)
+            yield logp[0, -(end - scored):].cpu().numpy()
+    finally:
+        model.train(was_training)
+
+def score_file(model, tokenizer, path, stride=None, batch_size=64, chunk_size=1 << 22, logprobs_out=None):
+    """ score the text file at path; returns (tokens scored, mean negative log-likelihood in nats)
+
+    The file is tokenized chunk_size characters at a time (a BPE merge cannot
+    span two chunks, as in chargpt.data.prepare). With logprobs_out, an open
+    binary file, the per-token log-probs are written to it as raw float32.
+    """
+    chunks = (tokenizer.encode(text) for text in _read_chunks(path, chunk_size))
+    n, total = 0, 0.0
+    for logp in score_tokens(model, chunks, stride, batch_size):
+        n += len(logp)
+        total += float(logp.sum(dtype=np.float64))
+        if logprobs_out is not None:
+            logp.astype(np.float32, copy=False).tofile(logprobs_out)
+    return n, (-total / n if n else float('nan'))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('checkpoint', help='checkpoint written by chargpt.train --out')
+    parser.add_argument('text', help='text file to score')
+    parser.add_argument('--stride', type=int, default=None, help='tokens between window starts (default block_size / 2)')
+    parser.add_argument('--batch-size', type=int, default=64, help='windows per forward pass')
+    parser.add_argument('--chunk-size', type=int, default=1 << 22, help='characters read and tokenized at a time')
+    parser.add_argument('--logprobs', default=None, help='write per-token log-probs to this file as raw float32')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--threads', type=int, default=None, help='torch threads to use')
+    args = parser.parse_args(argv)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    model, tokenizer = load_model(args.checkpoint, args.device)
+    t0 = time.perf_counter()
+    if args.logprobs:
+        with open(args.logprobs, 'wb') as f:
+            n, nll = score_file(model, tokenizer, args.text, args.stride, args.batch_size, args.chunk_size, f)
+    else:
+        n, nll = score_file(model, tokenizer, args.text, args.stride, args.batch_size, args.chunk_size)
+    elapsed = time.perf_counter() - t0
+    print(f"{args.text}: {n} tokens scored, loss {nll:.4f}, perplexity {math.exp(nll):.4f}, "
+          f"{n / elapsed:.0f} tokens/s")
+
+if __name__ == '__main__':
+    main()
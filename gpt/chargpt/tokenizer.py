@@ -0,0 +1,159 @@
+""" Tokenizers: the per-character vocabulary, and a trainable byte-level BPE.
+
+Both encode to NumPy arrays of token ids and are rebuilt from state_dict(),
+which checkpoints and prepared datasets store alongside the token ids:
+
+    tokenizer = BPETokenizer.train(text, vocab_size=512)
+    ids = tokenizer.encode(text)
+    assert tokenizer.decode(ids) == text
+    tokenizer = from_state(tokenizer.state_dict())
+"""
+import numpy as np
+
+class Tokenizer:
+    """ encode_batch/decode_batch in terms of encode/decode """
+
+    def encode_batch(self, texts, dtype=np.int32):
+        return [self.encode(text, dtype) for text in texts]
+
+    def decode_batch(self, seqs):
+        return [self.decode(ids) for ids in seqs]
+
+    def __eq__(self, other):
+        return isinstance(other, Tokenizer) and self.state_dict() == other.state_dict()
+
+class CharTokenizer(Tokenizer):
+    """ one token per character of a fixed vocabulary, looked up in a table indexed by code point """
+
+    def __init__(self, chars):
+        self.chars = list(chars)
+        self.vocab_size = len(self.chars)
+        self._codes = np.array([ord(c) for c in self.chars], dtype=np.uint32)
+        self._table = np.full(int(self._codes.max()) + 1 if len(self._codes) else 0, -1, dtype=np.int32)
+        self._table[self._codes] = np.arange(len(self._codes))
+
+    @classmethod
+    def from_text(cls, text):
+        """ the sorted vocabulary of characters that occur in text """
+        return cls(sorted(set(text)))
+
+    def encode(self, text, dtype=np.int32):
+        codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        ids = self._table[np.minimum(codes, len(self._table) - 1)] if len(codes) else codes.astype(np.int32)
+        if len(codes) and (ids.min() < 0 or codes.max() >= len(self._table)):
+            raise ValueError('text contains characters outside the vocabulary')
+        return ids.astype(dtype, copy=False)
+
+    def decode(self, ids):
+        return self._codes[np.asarray(ids, dtype=np.int64)].tobytes().decode('utf-32-le')
+
+    def encode_batch(self, texts, dtype=np.int32):
+        # one lookup over the concatenation; every character is one token, so lengths carry over
+        ids = self.encode(''.join(texts), dtype)
+        return np.split(ids, np.cumsum([len(t) for t in texts])[:-1])
+
+    def decode_batch(self, seqs):
+        seqs = [np.asarray(ids, dtype=np.int64) for ids in seqs]
+        text = self.decode(np.concatenate(seqs) if seqs else [])
+        ends = np.cumsum([len(ids) for ids in seqs])
+        return [text[end - len(ids):end] for ids, end in zip(seqs, ends)]
+
+    def state_dict(self):
+        return {'kind': 'char', 'chars': self.chars}
+
+def _merge(ids, pair, new):
+    """ replace every non-overlapping occurrence of pair in ids, left to right, with the token new """
+    a, b = pair
+    hits = np.flatnonzero((ids[:-1] == a) & (ids[1:] == b))
+    if a == b and len(hits) > 1:
+        # in a run like "aaaa" the matches overlap; keep every other one, counting from the start of the run
+        n = np.arange(len(hits))
+        run_start = np.maximum.accumulate(np.where(np.r_[True, np.diff(hits) != 1], n, 0))
+        hits = hits[(n - run_start) % 2 == 0]
+    if not len(hits):
+        return ids
+    keep = np.ones(len(ids), dtype=bool)
+    keep[hits + 1] = False
+    ids = ids.copy()
+    ids[hits] = new
+    return ids[keep]
+
+class BPETokenizer(Tokenizer):
+    """ byte-level byte-pair encoding: the 256 byte values, plus one token per learned merge
+
+    merges[i] is the pair of token ids that token 256 + i replaces. Encoding
+    applies the merges in the order they were learned, each as one vectorized
+    pass over the whole sequence, which gives the same tokens as merging the
+    lowest-ranked pair first.
+    """
+
+    def __init__(self, merges):
+        self.merges = [tuple(pair) for pair in merges]
+        self.vocab_size = 256 + len(self.merges)
+        self._bytes = [bytes([i]) for i in range(256)]
+        for a, b in self.merges:
+            self._bytes.append(self._bytes[a] + self._bytes[b])
+
+    @classmethod
+    def train(cls, text, vocab_size):
+        """ learn vocab_size - 256 merges from text, stopping early if no pair occurs twice """
+        assert 256 <= vocab_size <= 65536, 'vocab_size must be between 256 and 65536'
+        ids = np.frombuffer(text.encode('utf-8'), dtype=np.uint8).astype(np.int32)
+        merges = []
+        for new in range(256, vocab_size):
+            if len(ids) < 2:
+                break
+            pairs = ids[:-1].astype(np.int64) * new + ids[1:]
+            if new * new <= 1 << 22:
+                counts = np.bincount(pairs)
+                best = int(counts.argmax())
+                count = counts[best]
+            else: # a dense count table would be too big
+                values, counts = np.unique(pairs, return_counts=True)
+                i = counts.argmax()
+                best, count = int(values[i]), counts[i]
+            if count < 2:
+                break
+            pair = divmod(best, new)
+            merges.append(pair)
+            ids = _merge(ids, pair, new)
+        return cls(merges)
+
+    def _apply_merges(self, ids):
+        for i, pair in enumerate(self.merges):
+            if len(ids) < 2:
+                break
+            ids = _merge(ids, pair, 256 + i)
+        return ids
+
+    def encode(self, text, dtype=np.int32):
+        ids = np.frombuffer(text.encode('utf-8'), dtype=np.uint8).astype(np.int32)
+        return self._apply_merges(ids).astype(dtype, copy=False)
+
+    def encode_batch(self, texts, dtype=np.int32):
+        # join the texts with a -1 separator, which no merge matches, so each merge is one pass over the whole batch
+        parts = []
+        for text in texts:
+            parts.append(np.frombuffer(text.encode('utf-8'), dtype=np.uint8).astype(np.int32))
+            parts.append(np.array([-1], dtype=np.int32))
+        ids = self._apply_merges(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int32)
+        seqs = np.split(ids, np.flatnonzero(ids == -1) + 1)[:-1]
+        return [seq[:-1].astype(dtype, copy=False) for seq in seqs]
+
+    def decode(self, ids):
+        # a token can end partway through a multi-byte character, so decoding single tokens may give U+FFFD
+        return b''.join([self._bytes[i] for i in np.asarray(ids).tolist()]).decode('utf-8', errors='replace')
+
+    def state_dict(self):
+        return {'kind': 'bpe', 'merges': [list(pair) for pair in self.merges]}
+
+def from_state(state):
+    """ rebuild a tokenizer from its state_dict() """
+    if state['kind'] == 'char':
+        return CharTokenizer(state['chars'])
+    return BPETokenizer(state['merges'])
+
+def token_dtype(vocab_size):
+    """ the smallest unsigned dtype that holds every token id """
+    assert vocab_size <= 65536, 'vocab too large for uint16 ids'
+    return np.uint8 if vocab_size <= 256 else np.uint16
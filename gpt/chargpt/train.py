@@ -0,0 +1,248 @@
+""" Train the GPT or bigram model on a text file, then sample from it.
+
+Run from the gpt/ directory, e.g.:
+
+    python -m chargpt.train --model gpt --max-iters 5000 --out gpt.pt
+    python -m chargpt.train --resume gpt.pt
+    python -m chargpt.prepare input.txt data/shakespeare && python -m chargpt.train --data data/shakespeare
+
+Every hyperparameter of the model's config can be overridden with a flag.
+--metrics run.jsonl (or .csv) records per-step phase timings, tokens/sec,
+flops and peak memory, and --profile 100:105 writes a torch.profiler trace of
+those steps to --profile-out.
+--bpe-vocab-size N trains on a byte-level BPE of N tokens, learned from the
+text file, instead of its characters; the tokenizer is saved with the checkpoint.
+With --out, a checkpoint is written every checkpoint_interval steps; --resume
+continues a run from its checkpoint at exactly the step it was saved.
+--grad-accum N sums gradients over N batches per optimizer step; to train on
+several processes at once, start the run through chargpt.distributed.
+With --async-eval true, losses are estimated by a separate process that
+evaluates each checkpoint as it is written (see chargpt.evaluate).
+--dtype bfloat16 (or float16, with loss scaling) trains under autocast, and
+--compile true runs the training steps through torch.compile; see
+`python -m chargpt.bench precision` for what each buys on a given machine.
+--model bigram --fit counts skips training and sets the bigram table from
+pair counts over the training split (with --smoothing), which is the optimum
+SGD converges towards; `python -m chargpt.bench bigram` compares the two.
+"""
+import argparse
+import contextlib
+import inspect
+import multiprocessing
+import time
+
+import torch
+from torch.nn.parallel import DistributedDataParallel
+
+from chargpt.checkpoint import load_checkpoint, save_checkpoint, set_rng_state, tokenizer_from_checkpoint
+from chargpt.config import CONFIGS, add_config_args, autocast, config_from_args, init_device
+from chargpt.data import load_dataset, get_batch
+from chargpt.distributed import all_gather_object, get_rank, get_world_size, shard
+from chargpt.evaluate import Evaluator, watch
+from chargpt.loader import PrefetchLoader
+from chargpt.metrics import StepMetrics, StepProfiler
+from chargpt.model import build_model
+
+_ADAMW_FUSED = 'fused' in inspect.signature(torch.optim.AdamW).parameters
+
+def make_optimizer(model, config):
+    """ AdamW, with the fused kernel when config.fused_adamw is set and the device has one """
+    if config.fused_adamw and _ADAMW_FUSED:
+        try:
+            return torch.optim.AdamW(model.parameters(), lr=config.learning_rate, fused=True)
+        except RuntimeError:
+            pass # no fused kernel for these parameters' device
+    return torch.optim.AdamW(model.parameters(), lr=config.learning_rate)
+
+def make_grad_scaler(config, device):
+    """ loss scaler for float16 training; disabled (a pass-through) otherwise, bfloat16 has float32's range """
+    enabled = config.dtype == 'float16'
+    if hasattr(torch.amp, 'GradScaler'):
+        return torch.amp.GradScaler(device.type, enabled=enabled)
+    return torch.cuda.amp.GradScaler(enabled=enabled and device.type == 'cuda')
+
+def fit_counts(model_type, config, model, tokenizer, train_data, val_data, device, out=None, log=print):
+    """ the bigram model's closed-form fit: no optimizer or steps, just one counting pass over train_data """
+    if get_world_size() > 1:
+        raise ValueError('the counts fit is a single pass over the data; run it in one process')
+    t0 = time.perf_counter()
+    model.fit_counts(train_data, config.smoothing)
+    log(f"fit bigram counts over {len(train_data)} tokens in {time.perf_counter() - t0:.2f}s")
+    losses = Evaluator({'train': train_data, 'val': val_data}, config, device)(model)
+    log(f"counts fit (smoothing {config.smoothing}): train loss {losses['train']:.4f}, val loss {losses['val']:.4f}")
+    if out is not None:
+        save_checkpoint(out, model_type, config, tokenizer, model)
+        log(f"saved {out}")
+    return model
+
+def train(model_type, config, data_path='input.txt', out=None, resume=None, bpe_vocab_size=None,
+          metrics=None, profile=None, peak_tflops=None):
+    """ train a model, from scratch or from the checkpoint dict `resume`; returns (model, tokenizer)
+
+    Inside a torch.distributed process group (see chargpt.distributed) every
+    rank trains on its own shard of the training data, and only rank 0
+    evaluates, prints and writes checkpoints. `metrics` is a .jsonl or .csv
+    file for per-step StepMetrics records, and `profile` a (start, stop,
+    trace path) window of steps to trace with torch.profiler; both on rank 0.
+    """
+    device = init_device(config.device)
+    torch.manual_seed(config.seed)
+    rank, world_size = get_rank(), get_world_size()
+    is_main = rank == 0
+    log = print if is_main else lambda *args: None
+
+    tokenizer = tokenizer_from_checkpoint(resume) if resume is not None else None
+    train_data, val_data, data_tokenizer = load_dataset(data_path, tokenizer, bpe_vocab_size)
+    if tokenizer is not None and data_tokenizer != tokenizer:
+        raise ValueError(f"{data_path} has a different vocabulary than the checkpoint")
+    tokenizer = data_tokenizer
+    train_shard = shard(train_data, rank, world_size) if world_size > 1 else train_data
+
+    model = build_model(model_type, config, tokenizer.vocab_size)
+    m = model.to(device)
+    # print the number of parameters in the model
+    log(sum(p.numel() for p in m.parameters())/1e6, 'M parameters')
+
+    if getattr(config, 'fit', 'sgd') == 'counts':
+        return fit_counts(model_type, config, model, tokenizer, train_shard, val_data, device, out, log), tokenizer
+
+    # create a PyTorch optimizer
+    optimizer = make_optimizer(model, config)
+    scaler = make_grad_scaler(config, device)
+
+    start = 0
+    if resume is not None:
+        model.load_state_dict(resume['model'])
+        optimizer.load_state_dict(resume['optimizer'])
+        if 'scaler' in resume:
+            scaler.load_state_dict(resume['scaler'])
+        start = resume['iter']
+        set_rng_state(resume['rng'])
+        log(f"resuming at step {start}")
+
+    evaluator = eval_process = None
+    if is_main and config.async_eval:
+        if out is None:
+            raise ValueError('async evaluation follows the checkpoint file, so it needs --out')
+        ctx = multiprocessing.get_context('spawn')
+        eval_stop = ctx.Event()
+        # evaluation gets a single thread, so it takes as little as possible from training
+        eval_process = ctx.Process(target=watch, args=(out, data_path, config.device, eval_stop, 1.0, 1), daemon=True)
+        eval_process.start()
+    elif is_main:
+        evaluator = Evaluator({'train': train_data, 'val': val_data}, config, device)
+
+    # training steps go through the DDP wrapper and the compiled module; evaluation and checkpoints use the plain one
+    ddp = DistributedDataParallel(model) if world_size > 1 else None
+    step_model = ddp or model
+    step_model = torch.compile(step_model) if config.compile else step_model
+
+    # a distributed checkpoint holds every rank's loader state; each rank resumes its own
+    loader_state = resume.get('loader') if resume is not None else None
+    if isinstance(loader_state, list):
+        loader_state = loader_state[rank] if len(loader_state) == world_size else None
+    elif world_size > 1:
+        loader_state = None
+    loader = None
+    if config.prefetch > 0:
+        loader = PrefetchLoader(train_shard, config.block_size, config.batch_size, device, config.prefetch,
+                                seed=config.seed + rank, state=loader_state)
+
+    tokens_per_step = config.batch_size * config.block_size * config.grad_accum * world_size
+    stats = StepMetrics(model, tokens_per_step, device, metrics if is_main else None, peak_tflops)
+    profiler = StepProfiler(*profile, device) if profile is not None and is_main else None
+    for iter in range(start, config.max_iters):
+        # every once in a while evaluate the loss on train and val sets
+        if iter % config.eval_interval == 0 or iter == config.max_iters - 1:
+            report = []
+            # before evaluating, which would otherwise absorb the device work the last steps left queued
+            timings = stats.report()
+            if evaluator is not None:
+                losses = evaluator(model)
+                stats.record_losses(losses)
+                report.append(f"train loss {losses['train']:.4f}, val loss {losses['val']:.4f}")
+            if timings:
+                report.append(timings)
+            if report:
+                log(f"step {iter}: {', '.join(report)}")
+
+        if profiler is not None:
+            profiler.step(iter)
+        stats.begin()
+        step_loss = torch.zeros((), device=device)
+        for micro in range(config.grad_accum):
+            # sample a batch of data
+            with stats.phase('data'):
+                if loader is not None:
+                    xb, yb = next(loader)
+                else:
+                    xb, yb = get_batch(train_shard, config.block_size, config.batch_size, device)
+
+            # evaluate the loss; gradients are all-reduced across ranks on the last micro-batch only
+            sync = ddp.no_sync() if ddp is not None and micro < config.grad_accum - 1 else contextlib.nullcontext()
+            with sync:
+                with stats.phase('forward'), autocast(device, config.dtype):
+                    logits, loss = step_model(xb, yb)
+                with stats.phase('backward'):
+                    scaler.scale(loss / config.grad_accum).backward()
+            step_loss += loss.detach() / config.grad_accum
+        with stats.phase('optimizer'):
+            scaler.step(optimizer)
+            scaler.update()
+            optimizer.zero_grad(set_to_none=True)
+        stats.end(iter, step_loss)
+
+        if out is not None and ((iter + 1) % config.checkpoint_interval == 0 or iter == config.max_iters - 1):
+            loader_state = loader.state_dict() if loader is not None else None
+            if world_size > 1:
+                loader_state = all_gather_object(loader_state)
+            if is_main:
+                save_checkpoint(out, model_type, config, tokenizer, model, optimizer, iter + 1, loader_state, scaler)
+                log(f"step {iter}: saved {out}")
+    if loader is not None:
+        loader.close()
+    if profiler is not None:
+        profiler.close()
+    stats.close()
+    if eval_process is not None:
+        # let the evaluator catch up with the final checkpoint
+        eval_stop.set()
+        eval_process.join()
+    return model, tokenizer
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', choices=sorted(CONFIGS), default='gpt')
+    parser.add_argument('--data', default='input.txt', help='training text, or a directory written by chargpt.prepare')
+    parser.add_argument('--out', default=None, help='checkpoint file to write (defaults to --resume)')
+    parser.add_argument('--resume', default=None, help='checkpoint to continue training from')
+    parser.add_argument('--sample-tokens', type=int, default=500, help='how many tokens to sample after training')
+    parser.add_argument('--bpe-vocab-size', type=int, default=None,
+                        help='learn a byte-level BPE of this many tokens from --data instead of using its characters')
+    parser.add_argument('--metrics', default=None, help='append per-step metrics to this .jsonl or .csv file')
+    parser.add_argument('--profile', default=None, metavar='START:STOP', help='trace steps START..STOP-1 with torch.profiler')
+    parser.add_argument('--profile-out', default='trace.json', help='chrome trace file for --profile')
+    parser.add_argument('--peak-tflops', type=float, default=None, help="the device's peak tflops, to report MFU")
+    known, _ = parser.parse_known_args(argv)
+    ckpt = load_checkpoint(known.resume, mmap=False) if known.resume else None
+    model_type = ckpt['model_type'] if ckpt else known.model
+    add_config_args(parser, CONFIGS[model_type])
+    args = parser.parse_args(argv)
+    # a resumed run keeps its checkpointed hyperparameters, apart from flags given explicitly
+    base = CONFIGS[model_type](**ckpt['config']) if ckpt else None
+    config = config_from_args(CONFIGS[model_type], args, base)
+
+    profile = (*map(int, args.profile.split(':')), args.profile_out) if args.profile else None
+    model, tokenizer = train(model_type, config, args.data, args.out or args.resume, ckpt, args.bpe_vocab_size,
+                             args.metrics, profile, args.peak_tflops)
+    if get_rank() != 0:
+        return
+
+    # generate from the model
+    model.eval()
+    device = next(model.parameters()).device
+    context = torch.zeros((1, 1), dtype=torch.long, device=device)
+    print(tokenizer.decode(model.generate(context, max_new_tokens=args.sample_tokens)[0].tolist()))
+
+if __name__ == '__main__':
+    main()